@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# Times a dotdeb per_line step on a large synthetic Apache index page, matching each
+# line with re.search on the pattern string (as run_search did) and with the
+# step's precompiled regex.
+from pathlib import Path
+import argparse
+import re
+import statistics
+import sys
+import time
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+
+from libraries.dataClasses import Candidate  # noqa: E402
+from modules import dotdeb  # noqa: E402
+
+REGEX = r'<a href="tool_(?P<version>[\d.]+)_(?P<arch>\w+)\.deb">'
+
+SEARCHES = [
+    {
+        "kind": "per_line",
+        "url": "https://example.com/pool/main/t/tool/",
+        "regex": REGEX,
+        "regex_groups": ["version", "arch"],
+    },
+    {"kind": "filter_version"},
+    {"kind": "populate_system"},
+    {
+        "kind": "target",
+        "target": "download_url",
+        "url": "https://example.com/pool/main/t/tool/tool_{version}_{arch}.deb",
+    },
+]
+
+
+def page(entries: int) -> str:
+    lines = [
+        "<!DOCTYPE HTML PUBLIC \"-//W3C//DTD HTML 3.2 Final//EN\">",
+        "<html>",
+        " <head>",
+        "  <title>Index of /pool/main/t/tool</title>",
+        " </head>",
+        " <body>",
+        "<h1>Index of /pool/main/t/tool</h1>",
+        "<pre><a href=\"?C=N;O=D\">Name</a>                    <a href=\"?C=M;O=A\">Last modified</a>      <a href=\"?C=S;O=A\">Size</a>",
+        "<hr><a href=\"/pool/main/t/\">Parent Directory</a>                             -",
+    ]
+    for i in range(entries):
+        version = f"{i // 10000}.{i // 100 % 100}.{i % 100}"
+        arch = ("amd64", "arm64", "i386")[i % 3]
+        lines.append(
+            f'   <a href="tool_{version}_{arch}.deb">tool_{version}_{arch}.deb</a>   2024-01-01 12:00   {40 + i % 9}M  '
+        )
+    lines += ["<hr></pre>", "</body></html>"]
+    return "\n".join(lines)
+
+
+def per_line_uncompiled(search: dict, text: str) -> list[dict]:
+    # The per_line loop as run_search had it
+    rows = []
+    for line in text.split("\n"):
+        line = line.strip()
+        match = re.search(search["regex"], line.strip())
+        if match is None:
+            continue
+        groups = match.groups()
+        match_contents = {}
+        for i, k in enumerate(search["regex_groups"]):
+            match_contents[k] = groups[i]
+        rows.append(match_contents)
+    return rows
+
+
+def timed(func, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="fluffpkg dotdeb regex benchmark")
+    parser.add_argument("-e", "--entries", type=int, default=50_000)
+    parser.add_argument("-n", "--runs", type=int, default=10)
+    options = parser.parse_args()
+
+    text = page(options.entries)
+    dotdeb.get_lines = lambda url: iter(text.split("\n"))
+    candidate = Candidate(
+        "dotdeb", "Tool", "tool", [], "local:/bench.json", "", {"info_gathering": SEARCHES}
+    )
+    compiled = dotdeb.pipeline(candidate)
+    step = compiled.steps[0]
+    run = dotdeb._Run("download_url", "", compiled.version_scheme)
+
+    results = {
+        "per_line re.search": timed(
+            lambda: per_line_uncompiled(SEARCHES[0], text), options.runs
+        ),
+        "per_line compiled": timed(
+            lambda: list(step.run({}, run)["download_url"]), options.runs
+        ),
+        "load Pipeline()": timed(lambda: dotdeb.Pipeline(SEARCHES), options.runs * 100),
+        "load pipeline()": timed(lambda: dotdeb.pipeline(candidate), options.runs * 100),
+    }
+    assert len(list(step.run({}, run)["download_url"])) == options.entries
+
+    print(f"{options.entries} index entries, median of {options.runs} runs")
+    for name, ms in results.items():
+        print(f"{name:20} {ms:9.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# Times source and installed lookups on a large synthetic database, with the schema's
+# secondary indexes and again with them dropped.
+from pathlib import Path
+import argparse
+import contextlib
+import io
+import json
+import statistics
+import sys
+import tempfile
+import time
+
+root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+
+from libraries import databaseLib, manageInstalledLib, sourcesLib  # noqa: E402
+
+INDEXES = [
+    "candidates_source",
+    "candidates_module",
+    "candidates_name",
+    "installed_source",
+    "installed_module",
+]
+
+
+def seed(candidates: int, per_source: int) -> None:
+    sources = max(1, candidates // per_source)
+    with databaseLib.transaction():
+        databaseLib.executemany(
+            "INSERT INTO sources (kind, url) VALUES (?, ?)",
+            [("local", f"/bench/source-{s}.json") for s in range(sources)],
+        )
+        databaseLib.executemany(
+            "INSERT INTO candidates (module, name, package_name, categories, source, download_url, module_data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    "github-appimage" if i % 10 == 0 else "dotdeb",
+                    f"Tool {i:06d}",
+                    f"tool-{i:06d}",
+                    json.dumps(["Utility"]),
+                    f"local:/bench/source-{i // per_source}.json",
+                    f"https://example.com/tool-{i:06d}",
+                    "{}",
+                )
+                for i in range(candidates)
+            ),
+        )
+        # Installs only come from the first half of the sources, the second half can be removed
+        databaseLib.executemany(
+            "INSERT INTO installed (package_name, name, version, launcher, path, module, source, executable_path, version_locked) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    f"tool-{i:06d}",
+                    f"Tool {i:06d}",
+                    "1.0.0",
+                    False,
+                    False,
+                    "dotdeb",
+                    f"local:/bench/source-{i // per_source}.json",
+                    f"/opt/tool-{i:06d}",
+                    False,
+                )
+                for i in range(1, candidates // 2, 97)
+            ),
+        )
+
+
+def timed(func, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def measure(home: Path, indexed: bool, options) -> dict[str, float]:
+    databaseLib.close()
+    databaseLib.db_path = home / ("indexed.sqlite3" if indexed else "plain.sqlite3")
+    seed(options.candidates, options.per_source)
+    if not indexed:
+        for index in INDEXES:
+            databaseLib.execute(f"DROP INDEX {index}")
+    databaseLib.execute("ANALYZE")
+
+    # Removes sources from the second half, the one without installs
+    sources = max(1, options.candidates // options.per_source)
+    removals = max(1, min(options.runs, sources // 2))
+    removable = iter(range(sources - 1, sources - 1 - removals, -1))
+    middle = f"tool-{options.candidates // 2:06d}"
+    return {
+        "query exact": timed(lambda: sourcesLib.query(middle), options.runs),
+        "query substring": timed(lambda: sourcesLib.query("ool-0004"), options.runs),
+        "get_source": timed(lambda: sourcesLib.get_source("ool-00002"), options.runs),
+        "list_by_source": timed(
+            lambda: manageInstalledLib.list_by_source("local:/bench/source-1.json"),
+            options.runs,
+        ),
+        "remove_source": timed(
+            lambda: sourcesLib.remove_source(f"/bench/source-{next(removable)}.json"),
+            removals,
+        ),
+        "list": timed(sourcesLib.list, max(1, options.runs // 5)),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="fluffpkg schema index benchmark")
+    parser.add_argument("-c", "--candidates", type=int, default=100_000)
+    parser.add_argument("-p", "--per-source", type=int, default=1000)
+    parser.add_argument("-n", "--runs", type=int, default=20)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        plain = measure(Path(home), False, options)
+        indexed = measure(Path(home), True, options)
+        databaseLib.close()
+
+    print(f"{options.candidates} candidates, median of {options.runs} runs")
+    print(f"{'':16} {'no indexes':>12} {'indexed':>12}")
+    for name in plain:
+        speedup = plain[name] / indexed[name] if indexed[name] > 0 else float("inf")
+        print(
+            f"{name:16} {plain[name]:9.2f} ms {indexed[name]:9.2f} ms  {speedup:6.1f}x"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Cold start benchmark for the commands scripts and launchers call all the time.
+# Exits with 1 if a command goes over its time budget, or imports something it shouldn't.
+from pathlib import Path
+import argparse
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+root = Path(__file__).resolve().parent.parent
+
+# command: (arguments, budget in ms, modules that must not be imported)
+COMMANDS = {
+    "help": (["help"], 150, ["requests", "tabulate", "modules.github_appimage"]),
+    "execpath": (
+        ["execpath", "benchmark-package"],
+        150,
+        ["requests", "tabulate", "concurrent.futures"],
+    ),
+}
+
+
+def run(args: list[str], env: dict, importtime: bool = False) -> subprocess.CompletedProcess:
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else [])
+    return subprocess.run(
+        cmd + [str(root / "fluffpkg.py")] + args,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def imported_modules(stderr: str) -> set[str]:
+    modules = set()
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def seed(home: Path, env: dict) -> None:
+    # First run creates the database, then a package is installed for execpath to find
+    run(["execpath", "benchmark-package"], env)
+    conn = sqlite3.connect(home / ".fluffpkg" / "database.sqlite3")
+    conn.execute(
+        "INSERT INTO installed (package_name, name, version, launcher, path, module, source, executable_path, version_locked) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            "benchmark-package",
+            "Benchmark Package",
+            "1.0.0",
+            False,
+            False,
+            "github-appimage",
+            "manual:_",
+            str(home / "benchmark-package-1.0.0.AppImage"),
+            False,
+        ),
+    )
+    conn.commit()
+    conn.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="fluffpkg cold start benchmark")
+    parser.add_argument("-n", "--runs", type=int, default=20)
+    parser.add_argument(
+        "-s", "--scale", type=float, default=1.0, help="Multiply every budget"
+    )
+    options = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home)
+        seed(Path(home), env)
+        for name, (args, budget, forbidden) in COMMANDS.items():
+            timings = []
+            for _ in range(options.runs):
+                start = time.perf_counter()
+                run(args, env)
+                timings.append((time.perf_counter() - start) * 1000)
+            median = statistics.median(timings)
+            limit = budget * options.scale
+            imported = imported_modules(run(args, env, importtime=True).stderr)
+            leaked = [m for m in forbidden if m in imported]
+
+            status = "ok"
+            if median > limit or len(leaked) != 0:
+                status = "FAIL"
+                failed = True
+            print(f"{name:10} median {median:6.1f} ms (budget {limit:.0f} ms) {status}")
+            if len(leaked) != 0:
+                print(f"{'':10} imported {', '.join(leaked)}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,11 @@
 #!/usr/bin/env python3
-from pathlib import Path
-from tabulate import tabulate
 from libraries import sourcesLib
 from libraries import manageInstalledLib
 from libraries import launcherLib
 from libraries import pathLib
+from libraries import httpLib
+from libraries import settingsLib
+from libraries import outputLib
 import modules
 from libraries import moduleLib
 from libraries import argumentsLib
@@ -90,9 +91,6 @@ from libraries.dataClasses import Candidate
 
 # exit()
 
-Path("~/.fluffpkg").expanduser().mkdir(parents=True, exist_ok=True)
-Path("~/.fluffpkg/bin").expanduser().mkdir(parents=True, exist_ok=True)
-
 # import sys
 # import traceback
 # class TracePrints(object):
@@ -105,7 +103,11 @@ Path("~/.fluffpkg/bin").expanduser().mkdir(parents=True, exist_ok=True)
 
 
 # args = ["remove", "cura"]  # DEBUG
-args = sys.argv[1:]
+global_args, args = argumentsLib.parse_global_flags(sys.argv[1:])
+if global_args["--no-cache"]:
+    httpLib.use_cache = False
+if global_args["--refresh"]:
+    httpLib.refresh = True
 
 if len(args) == 0:
     argumentsLib.print_help()
@@ -118,6 +120,10 @@ args = argumentsLib.parse_args(args, combinedCommands)
 if not args:
     exit()
 
+if args.get("--format") is not None and args["--format"] not in outputLib.formats:
+    print("--format must be one of:", ", ".join(outputLib.formats))
+    exit()
+
 if args["command"] == "help":
     argumentsLib.print_help(args["command_help"], commandList=combinedCommands)
     exit()
@@ -126,6 +132,10 @@ if args["command"] == "install":
         query = sourcesLib.query(package_name)
         if type(query) is not sourcesLib.QueryResult:
             print(f"Could not find installation candidate for {package_name}")
+            suggestions = sourcesLib.suggest(package_name)
+            if len(suggestions) != 0:
+                names = [candidate.package_name for candidate in suggestions]
+                print("Did you mean:", ", ".join(names))
             exit()
         if query.kind == "weak_recommend":
             names = [candidate.package_name for candidate in query.candidates]
@@ -156,39 +166,108 @@ elif args["command"] == "remove":
             exit()
         moduleLib.remove(install.module, install, args)
 elif args["command"] == "upgrade":
-    if len(args["packages"]) == 0:
+    try:
+        workers = (
+            settingsLib.get("upgrade_workers")
+            if args["--jobs"] is None
+            else int(args["--jobs"])
+        )
+    except ValueError:
+        workers = 0
+    if workers < 1:
+        print("--jobs must be a whole number of at least 1")
+        exit()
+    upgrade_all = len(args["packages"]) == 0
+    if upgrade_all:
         print("Upgrading all packages")
         installed = manageInstalledLib.list()
-        max_name_len = max(len(i.name) for i in installed)
-        for install in installed:
-            try:
-                moduleLib.upgrade(install.module, install, args)
-            except AlreadyNewest:
-                print(
-                    f"Skipping {install.package_name},",
-                    " " * (max_name_len - len(install.package_name)),
-                    "already newest",
-                )
-            except SpecificVersion:
-                print(
-                    f"Skipping {install.package_name},",
-                    " " * (max_name_len - len(install.package_name)),
-                    "specific version",
-                )
     else:
-        packages = [
-            (package, manageInstalledLib.query(package)) for package in args["packages"]
-        ]
-        for package, install in packages:
+        installed = []
+        for package in args["packages"]:
+            install = manageInstalledLib.query(package)
             if install is None:
                 print(f"{package} is not installed.")
                 exit()
-            moduleLib.upgrade(install.module, install, args)
+            installed.append(install)
+    max_name_len = max((len(i.package_name) for i in installed), default=0)
+
+    candidates = {}
+    to_check = []
+    legacy = set()
+    unsupported = set()
+    for install in installed:
+        if not moduleLib.hasCommand(install.module, "check_latest"):
+            if moduleLib.hasCommand(install.module, "upgrade"):
+                legacy.add(install.package_name)
+            elif upgrade_all:
+                unsupported.add(install.package_name)
+            else:
+                print(f"Module {install.module} does not support upgrading")
+                exit()
+            continue
+        if install.version_locked and not args["--force"]:
+            continue
+        candidate = sourcesLib.get_source(install.package_name)
+        candidates[install.package_name] = candidate
+        if candidate is not None:
+            to_check.append((install, candidate))
+
+    if len(to_check) > 1:
+        print(f"Checking {len(to_check)} packages for new versions")
+    checks = moduleLib.check_all(to_check, args, workers)
+
+    for install in installed:
+        padding = " " * (max_name_len - len(install.package_name))
+        if install.package_name in unsupported:
+            print(f"Skipping {install.package_name},", padding, "can't be upgraded")
+            continue
+        if install.package_name in legacy and args["--dry-run"]:
+            print(f"Skipping {install.package_name},", padding, "can't plan a dry run")
+            continue
+        try:
+            if install.package_name in legacy:
+                if install.version_locked and not args["--force"]:
+                    raise SpecificVersion()
+                moduleLib.upgrade(install.module, install, args)
+                continue
+            latest = checks.get(install.package_name, None)
+            if isinstance(latest, Exception):
+                raise latest
+            candidate = candidates.get(install.package_name, None)
+            latest = moduleLib.plan_upgrade(install, candidate, args, latest=latest)
+            if args["--dry-run"]:
+                print(
+                    f"Would upgrade {install.package_name},",
+                    padding,
+                    f"{install.version} -> {latest['version']}",
+                )
+                continue
+            moduleLib.apply_upgrade(install.module, install, candidate, latest, args)
+        except AlreadyNewest:
+            if not upgrade_all:
+                raise
+            print(
+                f"Skipping {install.package_name},",
+                padding,
+                "already newest",
+            )
+        except SpecificVersion:
+            if not upgrade_all:
+                raise
+            print(
+                f"Skipping {install.package_name},",
+                padding,
+                "specific version",
+            )
 elif args["command"] == "versions":
     package_name = args["package"]
     candidate = sourcesLib.get_source(package_name)
     if candidate is None:
         print(f"{package_name} has no source.")
+        suggestions = sourcesLib.suggest(package_name)
+        if len(suggestions) != 0:
+            names = [candidate.package_name for candidate in suggestions]
+            print("Did you mean:", ", ".join(names))
         exit()
     if not moduleLib.hasCommand(candidate.module, "versions"):
         print(f"Module {candidate.module} does not support getting available versions")
@@ -207,25 +286,69 @@ elif args["command"] == "execpath":
 
     moduleLib.execpath(install.module, install, args)
 elif args["command"] == "list":
-    if args["--installed"]:
-        installed = manageInstalledLib.list()
-        print("Installed packages:")
-        table_data = []
-        for install in installed:
-            table_data.append(
+    try:
+        limit = None if args["--limit"] is None else int(args["--limit"])
+        offset = 0 if args["--offset"] is None else int(args["--offset"])
+    except ValueError:
+        print("--limit and --offset must be whole numbers")
+        exit()
+    sort = args["--sort"]
+    listLib = manageInstalledLib if args["--installed"] else sourcesLib
+    if sort is not None and sort not in listLib.sort_columns:
+        print(
+            f"Can't sort by '{sort}', use one of:", ", ".join(listLib.sort_columns)
+        )
+        exit()
+    listing = (args["--category"], sort, limit, offset)
+
+    if args["--installed"] and args["--format"] is not None:
+        outputLib.print_records(
+            args["--format"],
+            [
+                "name",
+                "version",
+                "version_locked",
+                "package_name",
+                "launcher",
+                "path",
+                "module",
+                "source",
+                "executable_path",
+            ],
+            (
                 [
                     install.name,
-                    install.version + (" [L]" if install.version_locked else ""),
+                    install.version,
+                    bool(install.version_locked),
                     install.package_name,
                     install.launcher,
                     install.path,
                     install.module,
                     install.source,
+                    install.executable_path,
                 ]
-            )
-        table = tabulate(
-            table_data,
-            headers=[
+                for install in manageInstalledLib.iterate(*listing)
+            ),
+        )
+    elif args["--format"] is not None:
+        outputLib.print_records(
+            args["--format"],
+            ["name", "package_name", "categories", "module", "source"],
+            (
+                [
+                    candidate.name,
+                    candidate.package_name,
+                    candidate.categories,
+                    candidate.module,
+                    candidate.source,
+                ]
+                for candidate in sourcesLib.iterate(*listing)
+            ),
+        )
+    elif args["--installed"]:
+        print("Installed packages:")
+        outputLib.print_table(
+            [
                 "Name",
                 "Version",
                 "Package Name",
@@ -234,25 +357,62 @@ elif args["command"] == "list":
                 "Module",
                 "Source",
             ],
+            manageInstalledLib.list_widths(*listing),
+            (
+                [
+                    install.name,
+                    install.version + (" [L]" if install.version_locked else ""),
+                    install.package_name,
+                    install.launcher,
+                    install.path,
+                    install.module,
+                    install.source,
+                ]
+                for install in manageInstalledLib.iterate(*listing)
+            ),
         )
-        print(table)
     else:
-        candidates = sourcesLib.list()
         print("Installation candidates:")
-        table_data = []
-        for candidate in candidates:
-            table_data.append(
+        outputLib.print_table(
+            ["Name", "Package Name", "Module", "Source"],
+            sourcesLib.list_widths(*listing),
+            (
                 [
                     candidate.name,
                     candidate.package_name,
                     candidate.module,
                     candidate.source,
                 ]
-            )
-        table = tabulate(
-            table_data, headers=["Name", "Package Name", "Module", "Source"]
+                for candidate in sourcesLib.iterate(*listing)
+            ),
         )
-        print(table)
+elif args["command"] == "search":
+    from tabulate import tabulate
+
+    try:
+        limit = 20 if args["--limit"] is None else int(args["--limit"])
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        print("--limit must be a whole number of at least 1")
+        exit()
+    results = sourcesLib.search(args["terms"], limit=limit)
+    if len(results) == 0:
+        print("No packages found")
+        exit()
+    table = tabulate(
+        [
+            [
+                candidate.name,
+                candidate.package_name,
+                ", ".join(candidate.categories),
+                candidate.module,
+            ]
+            for candidate in results
+        ],
+        headers=["Name", "Package Name", "Categories", "Module"],
+    )
+    print(table)
 elif args["command"] == "modify":
     package = args["package"]
     attribute = args["attribute"]["command"]
@@ -300,7 +460,7 @@ elif args["command"] == "remove-source":
 elif args["command"] == "update-source":
     sourcesLib.update_source(args["source"])
 elif args["command"] == "list-sources":
-    sourcesLib.list_sources()
+    sourcesLib.list_sources(args["--format"])
 elif args["command"] in moduleLib.commandNames():
     moduleLib.command(args["command"], args)
 else:
@@ -1,10 +1,9 @@
-from tabulate import tabulate
-
 from libraries.dataClasses import FlagArg, ValueArg, PosArg, PosArgs, CmdArg, Command
 from libraries.exceptions import UnknownCommand
 
 from libraries import sourcesLib
 from libraries import moduleLib
+from libraries import outputLib
 
 program_desc = "The Fluffy Multipurpose Package Installer :3 - ThawnyRose"
 
@@ -32,6 +31,19 @@ builtin_commands: list[Command] = [
         "List packages",
         [
             FlagArg("-i", "--installed", "Only list installed packages"),
+            ValueArg("-c", "--category", "Only list packages in a category"),
+            ValueArg("-s", "--sort", "Sort by name, package, module, source or version"),
+            ValueArg("-l", "--limit", "Maximum number of packages to list"),
+            ValueArg("-o", "--offset", "Number of packages to skip"),
+            ValueArg("-f", "--format", "Print as ndjson, json or tsv instead"),
+        ],
+    ),
+    Command(
+        "search",
+        "Search sources for packages",
+        [
+            ValueArg("-l", "--limit", "Maximum number of results (default 20)"),
+            PosArgs("terms", "Words to search for"),
         ],
     ),
     Command(
@@ -39,6 +51,8 @@ builtin_commands: list[Command] = [
         "Upgrade packages",
         [
             FlagArg("-f", "--force", "Overrides version lock"),
+            FlagArg("-d", "--dry-run", "Only show which packages would be upgraded"),
+            ValueArg("-j", "--jobs", "Number of concurrent version checks"),
             PosArgs("packages", "Packages to upgrade", optional=True),
         ],
     ),
@@ -113,7 +127,10 @@ builtin_commands: list[Command] = [
     Command(
         "versions",
         "Get available versions for a package",
-        [PosArg("package", "Package to get versions for")],
+        [
+            PosArg("package", "Package to get versions for"),
+            ValueArg("-f", "--format", "Print as ndjson, json or tsv instead"),
+        ],
     ),
     Command(
         "execpath",
@@ -121,6 +138,7 @@ builtin_commands: list[Command] = [
         [
             PosArg("package", "Package to find path for"),
             FlagArg("-v", "--noversion", "Return with a glob for the file version"),
+            ValueArg("-f", "--format", "Print as ndjson, json or tsv instead"),
         ],
     ),
     Command(
@@ -138,7 +156,16 @@ builtin_commands: list[Command] = [
         "Copy a remote source into the local database",
         [PosArg("source", "File or link to source")],
     ),
-    Command("list-sources", "List sources", []),
+    Command(
+        "list-sources",
+        "List sources",
+        [ValueArg("-f", "--format", "Print as ndjson, json or tsv instead")],
+    ),
+]
+
+global_flags: list[FlagArg] = [
+    FlagArg("-n", "--no-cache", "Don't read or write the HTTP cache"),
+    FlagArg("-r", "--refresh", "Revalidate cached pages even if they haven't expired"),
 ]
 
 
@@ -169,8 +196,7 @@ def help_all_cmds(commandList: list[Command] = builtin_commands) -> str:
                 command.help,
             ]
         )
-    table = tabulate(table_data, tablefmt="plain")
-    return table
+    return outputLib.plain_table(table_data)
 
 
 def print_help(
@@ -182,6 +208,26 @@ def print_help(
         print(program_desc)
         print("Available commands:")
         print(help_all_cmds(commandList))
+        print("Global options (before the command):")
+        print(
+            outputLib.plain_table(
+                [["", f.name, "", "", f.help] for f in global_flags]
+            )
+        )
+
+
+def parse_global_flags(cmd_args: list[str]) -> tuple[dict, list[str]]:
+    # Only before the command (or up to a --), so values and terms after it that happen
+    # to look like a global flag are left alone
+    output = {f.name: False for f in global_flags}
+    for i, a in enumerate(cmd_args):
+        if a == "--":
+            return output, cmd_args[i + 1 :]
+        flag = next((f for f in global_flags if a in (f.name, f.short)), None)
+        if flag is None:
+            return output, cmd_args[i:]
+        output[flag.name] = True
+    return output, []
 
 
 def parse_modify(
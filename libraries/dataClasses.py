@@ -1,9 +1,11 @@
 import json
 
-from tabulate import tabulate
+from libraries import outputLib
 
 
 class Source:
+    __slots__ = ("kind", "url")
+
     def __init__(self, kind: str, url: str):
         self.kind = kind
         self.url = url
@@ -12,8 +14,23 @@ class Source:
         return f"{self.kind}:{self.url}"
 
 
+# Rows are often only listed, so the JSON and source columns are kept as the strings
+# the database returned and only decoded when a field is first read
+
+
 class Installation:
-    source: Source
+    __slots__ = (
+        "package_name",
+        "name",
+        "version",
+        "launcher",
+        "path",
+        "module",
+        "_source",
+        "executable_path",
+        "version_locked",
+        "sha256",
+    )
 
     def __init__(
         self,
@@ -26,6 +43,7 @@ class Installation:
         source: Source | str,
         executable_path: str,
         version_locked: bool,
+        sha256: str | None = None,
     ):
         self.name = name
         self.version = version
@@ -33,17 +51,36 @@ class Installation:
         self.launcher = bool(launcher)
         self.path = bool(path)
         self.module = module
-        self.source = (
-            source if isinstance(source, Source) else Source(*(source.split(":", 1)))
-        )
+        self._source = source
         self.executable_path = executable_path
         self.version_locked = version_locked
+        self.sha256 = sha256
+
+    @classmethod
+    def from_row(cls, cursor, row: tuple) -> "Installation":
+        return cls(*row)
+
+    @property
+    def source(self) -> Source:
+        if not isinstance(self._source, Source):
+            self._source = Source(*(self._source.split(":", 1)))
+        return self._source
+
+    @source.setter
+    def source(self, value: Source | str) -> None:
+        self._source = value
 
 
 class Candidate:
-    categories: list[str]
-    source: Source
-    module_data: dict
+    __slots__ = (
+        "module",
+        "name",
+        "package_name",
+        "_categories",
+        "_source",
+        "download_url",
+        "_module_data",
+    )
 
     def __init__(
         self,
@@ -58,20 +95,48 @@ class Candidate:
         self.module = module
         self.name = name
         self.package_name = package_name
-        self.categories = (
-            json.loads(categories) if isinstance(categories, str) else categories
-        )
-        self.source = (
-            source if isinstance(source, Source) else Source(*(source.split(":", 1)))
-        )
+        self._categories = categories
+        self._source = source
         self.download_url = download_url
-        if isinstance(module_data, str):
-            if module_data == "":
-                self.module_data = {}
-            else:
-                self.module_data = json.loads(module_data)
-        else:
-            self.module_data = {}
+        self._module_data = module_data
+
+    @classmethod
+    def from_row(cls, cursor, row: tuple) -> "Candidate":
+        return cls(*row)
+
+    @property
+    def categories(self) -> list[str]:
+        if isinstance(self._categories, str):
+            self._categories = json.loads(self._categories)
+        return self._categories
+
+    @categories.setter
+    def categories(self, value: str | list[str]) -> None:
+        self._categories = value
+
+    @property
+    def source(self) -> Source:
+        if not isinstance(self._source, Source):
+            self._source = Source(*(self._source.split(":", 1)))
+        return self._source
+
+    @source.setter
+    def source(self, value: Source | str) -> None:
+        self._source = value
+
+    @property
+    def module_data(self) -> dict:
+        if isinstance(self._module_data, str):
+            self._module_data = (
+                {} if self._module_data == "" else json.loads(self._module_data)
+            )
+        elif self._module_data is None:
+            self._module_data = {}
+        return self._module_data
+
+    @module_data.setter
+    def module_data(self, value: dict | str) -> None:
+        self._module_data = value
 
 
 class QueryResult:
@@ -148,7 +213,7 @@ class Command:
         if len(self.args) != 0:
             output += "Arguments:\n"
         table_data = [["", arg.name, "", "", arg.help] for arg in self.args]
-        output += tabulate(table_data, tablefmt="plain")
+        output += outputLib.plain_table(table_data)
         return output
 
     def __repr__(self):
@@ -167,6 +232,6 @@ class CmdArg(Arg):
         output += "Attributes:\n"
 
         table_data = [["", command.name, "", "", command.help] for command in self.cmds]
-        output += tabulate(table_data, tablefmt="plain")
+        output += outputLib.plain_table(table_data)
 
         return output
@@ -0,0 +1,295 @@
+from contextlib import contextmanager
+from pathlib import Path
+import sqlite3
+
+db_path = Path("~/.fluffpkg/database.sqlite3").expanduser()
+
+_connection: sqlite3.Connection | None = None
+
+
+def _migration_1(conn: sqlite3.Connection) -> None:
+    # Databases from before versioning already have these tables, so adopt them as they are
+    conn.execute(
+        """
+CREATE TABLE IF NOT EXISTS installed (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    package_name TEXT UNIQUE NOT NULL,
+    name TEXT,
+    version TEXT,
+    launcher BOOL,
+    path BOOL,
+    module TEXT,
+    source TEXT,
+    executable_path TEXT,
+    version_locked BOOL
+)
+"""
+    )
+    conn.execute(
+        """
+CREATE TABLE IF NOT EXISTS candidates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    module TEXT,
+    name TEXT,
+    package_name TEXT UNIQUE NOT NULL,
+    categories TEXT,
+    source TEXT,
+    download_url TEXT,
+    module_data TEXT
+)
+"""
+    )
+    conn.execute(
+        """
+CREATE TABLE IF NOT EXISTS sources (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT,
+    url TEXT
+)
+"""
+    )
+
+
+def _migration_2(conn: sqlite3.Connection) -> None:
+    columns = [c[1] for c in conn.execute("PRAGMA table_info(installed)").fetchall()]
+    if "sha256" not in columns:
+        conn.execute("ALTER TABLE installed ADD COLUMN sha256 TEXT")
+    conn.execute(
+        """
+CREATE TABLE IF NOT EXISTS artifacts (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    size INTEGER
+)
+"""
+    )
+
+
+def _migration_3(conn: sqlite3.Connection) -> None:
+    # Hash of everything a source file says about a candidate, NULL until it is next written
+    conn.execute("ALTER TABLE candidates ADD COLUMN content_hash TEXT")
+
+
+def _migration_4(conn: sqlite3.Connection) -> None:
+    # package_name already has the index from its UNIQUE constraint
+    conn.execute("CREATE INDEX IF NOT EXISTS candidates_source ON candidates (source)")
+    conn.execute("CREATE INDEX IF NOT EXISTS candidates_module ON candidates (module)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS candidates_name ON candidates (name COLLATE NOCASE)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS installed_source ON installed (source)")
+    conn.execute("CREATE INDEX IF NOT EXISTS installed_module ON installed (module)")
+
+
+def _migration_5(conn: sqlite3.Connection) -> None:
+    # Full text index over candidates, the triggers keep it in step with the table
+    conn.execute(
+        """
+CREATE VIRTUAL TABLE candidates_fts USING fts5 (
+    name,
+    package_name,
+    categories,
+    content = 'candidates',
+    content_rowid = 'id',
+    prefix = '2 3'
+)
+"""
+    )
+    conn.execute(
+        """
+CREATE TRIGGER candidates_fts_insert AFTER INSERT ON candidates BEGIN
+    INSERT INTO candidates_fts (rowid, name, package_name, categories)
+    VALUES (new.id, new.name, new.package_name, new.categories);
+END
+"""
+    )
+    conn.execute(
+        """
+CREATE TRIGGER candidates_fts_delete AFTER DELETE ON candidates BEGIN
+    INSERT INTO candidates_fts (candidates_fts, rowid, name, package_name, categories)
+    VALUES ('delete', old.id, old.name, old.package_name, old.categories);
+END
+"""
+    )
+    conn.execute(
+        """
+CREATE TRIGGER candidates_fts_update AFTER UPDATE OF name, package_name, categories ON candidates BEGIN
+    INSERT INTO candidates_fts (candidates_fts, rowid, name, package_name, categories)
+    VALUES ('delete', old.id, old.name, old.package_name, old.categories);
+    INSERT INTO candidates_fts (rowid, name, package_name, categories)
+    VALUES (new.id, new.name, new.package_name, new.categories);
+END
+"""
+    )
+    conn.execute("INSERT INTO candidates_fts (candidates_fts) VALUES ('rebuild')")
+
+
+def _trigram_select(rows: str) -> str:
+    # Trigrams of the lowercased name and package name, padded so word starts count more
+    return f"""
+WITH RECURSIVE rows (id, package_name, name) AS ({rows}),
+texts (id, text) AS (
+    SELECT id, '  ' || lower(package_name) || ' ' FROM rows
+    UNION ALL
+    SELECT id, '  ' || lower(name) || ' ' FROM rows WHERE name IS NOT NULL
+),
+grams (id, text, i) AS (
+    SELECT id, text, 1 FROM texts
+    UNION ALL
+    SELECT id, text, i + 1 FROM grams WHERE i < length(text) - 2
+)
+SELECT substr(text, i, 3) AS trigram, id FROM grams
+"""
+
+
+_TRIGRAM_INSERT = "INSERT OR IGNORE INTO candidate_trigrams (trigram, candidate_id)"
+_TRIGRAM_NEW = _trigram_select("SELECT new.id, new.package_name, new.name")
+
+
+def _migration_6(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+CREATE TABLE candidate_trigrams (
+    trigram TEXT NOT NULL,
+    candidate_id INTEGER NOT NULL,
+    PRIMARY KEY (trigram, candidate_id)
+) WITHOUT ROWID
+"""
+    )
+    # Deletes recompute the old row's trigrams instead of needing an index on candidate_id
+    insert = _TRIGRAM_INSERT
+    new = _TRIGRAM_NEW
+    old = _trigram_select("SELECT old.id, old.package_name, old.name")
+    delete = f"DELETE FROM candidate_trigrams WHERE candidate_id = old.id AND trigram IN (SELECT trigram FROM ({old}))"
+    conn.execute(
+        f"CREATE TRIGGER candidate_trigrams_insert AFTER INSERT ON candidates BEGIN {insert} {new}; END"
+    )
+    conn.execute(
+        f"CREATE TRIGGER candidate_trigrams_delete AFTER DELETE ON candidates BEGIN {delete}; END"
+    )
+    conn.execute(
+        f"CREATE TRIGGER candidate_trigrams_update AFTER UPDATE OF name, package_name ON candidates BEGIN {delete}; {insert} {new}; END"
+    )
+    conn.execute(
+        f"{insert} {_trigram_select('SELECT id, package_name, name FROM candidates')}"
+    )
+
+
+def _migration_7(conn: sqlite3.Connection) -> None:
+    # candidates.categories stays the JSON the rest of the code reads, this is its
+    # normalized copy for filtering, filled from the JSON by the triggers
+    conn.execute(
+        """
+CREATE TABLE candidate_categories (
+    package_name TEXT NOT NULL,
+    category TEXT NOT NULL,
+    PRIMARY KEY (package_name, category)
+) WITHOUT ROWID
+"""
+    )
+    conn.execute(
+        "CREATE INDEX candidate_categories_category ON candidate_categories (category COLLATE NOCASE, package_name)"
+    )
+    insert = "INSERT OR IGNORE INTO candidate_categories (package_name, category) SELECT new.package_name, value FROM json_each(CASE WHEN json_valid(new.categories) THEN new.categories ELSE '[]' END) WHERE type = 'text'"
+    delete = "DELETE FROM candidate_categories WHERE package_name = old.package_name"
+    conn.execute(
+        f"CREATE TRIGGER candidate_categories_insert AFTER INSERT ON candidates BEGIN {insert}; END"
+    )
+    conn.execute(
+        f"CREATE TRIGGER candidate_categories_delete AFTER DELETE ON candidates BEGIN {delete}; END"
+    )
+    conn.execute(
+        f"CREATE TRIGGER candidate_categories_update AFTER UPDATE OF package_name, categories ON candidates BEGIN {delete}; {insert}; END"
+    )
+    conn.execute(
+        "INSERT OR IGNORE INTO candidate_categories (package_name, category) SELECT c.package_name, j.value FROM candidates c, json_each(CASE WHEN json_valid(c.categories) THEN c.categories ELSE '[]' END) j WHERE j.type = 'text'"
+    )
+
+
+def _migration_8(conn: sqlite3.Connection) -> None:
+    # Bulk imports add trigrams themselves, running the trigger's recursive CTE per row was
+    # most of an import. While an import's transaction has a row in here the insert
+    # trigger leaves its rows alone
+    conn.execute("CREATE TABLE candidate_trigrams_deferred (deferred INTEGER)")
+    conn.execute("DROP TRIGGER candidate_trigrams_insert")
+    conn.execute(
+        f"CREATE TRIGGER candidate_trigrams_insert AFTER INSERT ON candidates WHEN NOT EXISTS (SELECT 1 FROM candidate_trigrams_deferred) BEGIN {_TRIGRAM_INSERT} {_TRIGRAM_NEW}; END"
+    )
+
+
+# Append only, the position of a migration is the schema version it brings the database to
+_MIGRATIONS = [
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+    _migration_6,
+    _migration_7,
+    _migration_8,
+]
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(_MIGRATIONS):
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another process may have migrated while we waited for the write lock
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(_MIGRATIONS[version:], start=version + 1):
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def connection() -> sqlite3.Connection:
+    # Autocommit by default, anything that writes more than one statement uses transaction()
+    global _connection
+    if _connection is None:
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(db_path, isolation_level=None, cached_statements=256)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA cache_size = -8192")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        _migrate(conn)
+        _connection = conn
+    return _connection
+
+
+def close() -> None:
+    global _connection
+    if _connection is not None:
+        _connection.close()
+        _connection = None
+
+
+def execute(sql: str, parameters: tuple | dict = (), row_factory=None) -> sqlite3.Cursor:
+    cursor = connection().execute(sql, parameters)
+    if row_factory is not None:
+        cursor.row_factory = row_factory
+    return cursor
+
+
+def executemany(sql: str, parameters) -> sqlite3.Cursor:
+    return connection().executemany(sql, parameters)
+
+
+@contextmanager
+def transaction():
+    conn = connection()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
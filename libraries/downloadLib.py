@@ -0,0 +1,316 @@
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait
+import hashlib
+import json
+import os
+import threading
+import time
+
+from libraries import httpLib
+from libraries import settingsLib
+from libraries.utilitiesLib import format_size
+
+
+class _RangesNotHonoured(Exception):
+    pass
+
+
+class _StreamHasher:
+    def __init__(self, algorithms: list[str]):
+        self.algorithms = algorithms
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.hashes = {a: hashlib.new(a) for a in self.algorithms}
+        self.position = 0
+
+    def update(self, data: bytes) -> None:
+        for h in self.hashes.values():
+            h.update(data)
+        self.position += len(data)
+
+    def catch_up(self, fd: int, end: int) -> None:
+        # Only bytes that couldn't be hashed as they arrived are read back
+        while self.position < end:
+            data = os.pread(fd, min(1024 * 1024, end - self.position), self.position)
+            if not data:
+                break
+            self.update(data)
+
+    def hexdigests(self) -> dict[str, str]:
+        return {a: h.hexdigest() for a, h in self.hashes.items()}
+
+
+class _DownloadProgress:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.started = time.time()
+        self.timeMark = self.started + 1
+
+    def add(self, amount: int) -> None:
+        with self.lock:
+            self.bytes += amount
+
+    def tick(self) -> None:
+        if time.time() > self.timeMark:
+            print(".", end="", flush=True)
+            self.timeMark = time.time() + 1
+
+    def summary(self) -> str:
+        elapsed = max(time.time() - self.started, 0.001)
+        return f"{format_size(self.bytes)} in {elapsed:.1f}s ({format_size(self.bytes / elapsed)}/s)"
+
+
+def _read_part_info(info_path: Path, url: str) -> dict | None:
+    try:
+        with open(info_path, "r") as f:
+            info = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return info if info.get("url") == url else None
+
+
+def _write_part_info(info_path: Path, info: dict) -> None:
+    with open(info_path, "w") as f:
+        json.dump(info, f)
+
+
+def _range_headers(info: dict, start: int, end: int | None = None) -> dict:
+    headers = {"Range": f"bytes={start}-" if end is None else f"bytes={start}-{end}"}
+    validator = info.get("etag") or info.get("last_modified")
+    if validator:
+        headers["If-Range"] = validator
+    return headers
+
+
+def _can_segment(response, info: dict) -> bool:
+    return (
+        settingsLib.get("download_segments") > 1
+        and response.headers.get("Accept-Ranges", "").lower() == "bytes"
+        and info["content_length"] is not None
+        and info["content_length"] >= settingsLib.get("download_segment_min_bytes")
+    )
+
+
+def _contiguous_end(segments: list[list[int]]) -> int:
+    for start, end, done in segments:
+        if done < end - start:
+            return start + done
+    return segments[-1][1]
+
+
+def _fetch_segment(
+    url: str,
+    fd: int,
+    info: dict,
+    segment: list[int],
+    progress: _DownloadProgress,
+    hasher: _StreamHasher,
+    response=None,
+) -> None:
+    start, end = segment[0], segment[1]
+    attempts = settingsLib.get("download_attempts")
+    chunk_size = settingsLib.get("download_chunk_size")
+    while segment[2] < end - start:
+        offset = start + segment[2]
+        try:
+            if response is None:
+                response = httpLib.get(
+                    url, stream=True, headers=_range_headers(info, offset, end - 1)
+                )
+                response.raise_for_status()
+                if response.status_code != 206:
+                    response.close()
+                    raise _RangesNotHonoured()
+            with response:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    # The response reused for the first segment runs to the end of the file
+                    chunk = chunk[: end - offset]
+                    os.pwrite(fd, chunk, offset)
+                    with hasher.lock:
+                        if hasher.position == offset:
+                            hasher.update(chunk)
+                        segment[2] += len(chunk)
+                    offset += len(chunk)
+                    progress.add(len(chunk))
+                    if offset >= end:
+                        break
+        except httpLib.HTTPError:
+            raise
+        except httpLib.RequestException:
+            pass
+        response = None
+        if segment[2] < end - start:
+            attempts -= 1
+            if attempts <= 0:
+                raise httpLib.HTTPError(f"Download of {url} ended early")
+
+
+def _download_segmented(
+    url: str,
+    part_path: Path,
+    info_path: Path,
+    info: dict,
+    progress: _DownloadProgress,
+    hasher: _StreamHasher,
+    first_response=None,
+) -> bool:
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT)
+    try:
+        if os.fstat(fd).st_size != info["content_length"]:
+            try:
+                os.posix_fallocate(fd, 0, info["content_length"])
+            except (AttributeError, OSError):
+                os.ftruncate(fd, info["content_length"])
+        with ThreadPoolExecutor(max_workers=len(info["segments"])) as executor:
+            futures = [
+                executor.submit(
+                    _fetch_segment,
+                    url,
+                    fd,
+                    info,
+                    segment,
+                    progress,
+                    hasher,
+                    first_response if i == 0 else None,
+                )
+                for i, segment in enumerate(info["segments"])
+                if segment[2] < segment[1] - segment[0]
+            ]
+            pending = futures
+            while len(pending) != 0:
+                _, pending = wait(pending, timeout=1)
+                progress.tick()
+                with hasher.lock:
+                    hasher.catch_up(fd, _contiguous_end(info["segments"]))
+                _write_part_info(info_path, info)
+        for future in futures:
+            future.result()
+    except _RangesNotHonoured:
+        return False
+    finally:
+        os.close(fd)
+    return True
+
+
+def _download_single(
+    url: str,
+    part_path: Path,
+    info_path: Path,
+    info: dict | None,
+    progress: _DownloadProgress,
+    hasher: _StreamHasher,
+    allow_segments: bool = True,
+) -> None:
+    attempts = settingsLib.get("download_attempts")
+    chunk_size = settingsLib.get("download_chunk_size")
+    while True:
+        offset = part_path.stat().st_size if info is not None else 0
+        headers = _range_headers(info, offset) if offset > 0 else {}
+        try:
+            r = httpLib.get(url, stream=True, headers=headers)
+            if r.status_code == 416 and info is not None:
+                r.close()
+                if offset == info.get("content_length"):
+                    break
+                info = None
+                continue
+            r.raise_for_status()
+            if r.status_code != 206:
+                offset = 0
+                length = r.headers.get("Content-Length")
+                info = {
+                    "url": url,
+                    "etag": r.headers.get("ETag"),
+                    "last_modified": r.headers.get("Last-Modified"),
+                    "content_length": None if length is None else int(length),
+                }
+                if allow_segments and _can_segment(r, info):
+                    size = -(-info["content_length"] // settingsLib.get("download_segments"))
+                    info["segments"] = [
+                        [start, min(start + size, info["content_length"]), 0]
+                        for start in range(0, info["content_length"], size)
+                    ]
+                    _write_part_info(info_path, info)
+                    part_path.unlink(missing_ok=True)
+                    if _download_segmented(
+                        url,
+                        part_path,
+                        info_path,
+                        info,
+                        progress,
+                        hasher,
+                        first_response=r,
+                    ):
+                        return
+                    info = None
+                    allow_segments = False
+                    continue
+                _write_part_info(info_path, info)
+            if hasher.position != offset:
+                hasher.reset()
+                if offset > 0:
+                    with open(part_path, "rb") as f:
+                        hasher.catch_up(f.fileno(), offset)
+            with r:
+                with open(part_path, "ab" if offset > 0 else "wb") as f:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        progress.tick()
+                        f.write(chunk)
+                        hasher.update(chunk)
+                        progress.add(len(chunk))
+        except httpLib.HTTPError:
+            raise
+        except httpLib.RequestException:
+            attempts -= 1
+            if attempts <= 0:
+                raise
+            print("!", end="", flush=True)
+            continue
+        if (
+            info.get("content_length") is None
+            or part_path.stat().st_size >= info["content_length"]
+        ):
+            break
+        attempts -= 1
+        if attempts <= 0:
+            raise httpLib.HTTPError(f"Download of {url} ended early")
+
+
+# https://stackoverflow.com/a/16696317
+def download_file(
+    url: str,
+    output: str | None = None,
+    prettyname: str = "",
+    algorithms: list[str] = ["sha256"],
+) -> tuple[str, dict[str, str]]:
+    print(f"Downloading '{prettyname}' .", end="", flush=True)
+    local_filename = output if output is not None else url.split("/")[-1]
+    part_path = Path(f"{local_filename}.part")
+    info_path = Path(f"{local_filename}.part.json")
+    progress = _DownloadProgress()
+    hasher = _StreamHasher(algorithms)
+
+    # Whatever survived a previous run is kept as long as the server still has the same file
+    info = _read_part_info(info_path, url) if part_path.exists() else None
+    try:
+        if info is None or "segments" not in info:
+            _download_single(url, part_path, info_path, info, progress, hasher)
+        elif not _download_segmented(
+            url, part_path, info_path, info, progress, hasher
+        ):
+            _download_single(
+                url, part_path, info_path, None, progress, hasher, allow_segments=False
+            )
+    except httpLib.RequestException:
+        print()
+        raise
+
+    with open(part_path, "rb") as f:
+        hasher.catch_up(f.fileno(), os.fstat(f.fileno()).st_size)
+    os.replace(part_path, local_filename)
+    info_path.unlink(missing_ok=True)
+    print(" " + progress.summary())
+    return local_filename, hasher.hexdigests()
@@ -72,6 +72,16 @@ class SourceAlreadyExists(SilentException):
         super().__init__("This source is already included. Please update it instead")
 
 
+### StoreLib
+
+
+class ChecksumMismatch(SilentException):
+    def __init__(self, name: str, algorithm: str):
+        super().__init__(
+            f"Downloaded '{name}' doesn't match its published {algorithm} checksum"
+        )
+
+
 ### ArgumentLib
 class UnknownCommand(SilentException):
     def __init__(self, command: str):
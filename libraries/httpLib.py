@@ -0,0 +1,331 @@
+from pathlib import Path
+from typing import Iterator
+import json
+import os
+import threading
+import time
+
+from libraries import settingsLib
+
+cache_path = Path("~/.fluffpkg/cache/http").expanduser()
+
+use_cache = True
+refresh = False
+
+_session = None
+_pool_size = 10
+_session_lock = threading.Lock()
+
+# Pages already fetched by this process, whatever their age on disk, and the pages being
+# fetched right now with the thread fetching them
+_pages: dict[str, str] = {}
+_fetching: dict[str, tuple[int, threading.Event]] = {}
+_pages_lock = threading.Lock()
+
+
+def __getattr__(name: str):
+    # requests is slow to import, so its exceptions are only looked up when a caller needs them
+    if name in ("HTTPError", "RequestException"):
+        import requests
+
+        return getattr(requests.exceptions, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _mount(s) -> None:
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retries = Retry(
+        total=settingsLib.get("http_retries"),
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("GET", "HEAD"),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=10, pool_maxsize=_pool_size, max_retries=retries
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+
+
+def session():
+    # One keep-alive session per process, so each host only pays for its handshake once
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+
+            _session = requests.Session()
+            _mount(_session)
+    return _session
+
+
+def reserve_connections(workers: int) -> None:
+    # Every thread using the session at once needs its own connection per host, the
+    # pool would otherwise discard the extra ones
+    global _pool_size
+    with _session_lock:
+        if workers <= _pool_size:
+            return
+        _pool_size = workers
+        if _session is not None:
+            _mount(_session)
+
+
+def get(url: str, **kwargs):
+    kwargs.setdefault("timeout", settingsLib.get("http_timeout"))
+    return session().get(url, **kwargs)
+
+
+class CachedResponse:
+    def __init__(
+        self,
+        url: str,
+        status_code: int,
+        text: str | None,
+        from_cache: bool,
+        lines: Iterator[str] | None = None,
+    ):
+        self.url = url
+        self.status_code = status_code
+        self.text = text
+        self.from_cache = from_cache
+        self._lines = lines
+
+    def json(self):
+        return json.loads(self.text)
+
+    def iter_lines(self) -> Iterator[str]:
+        if self._lines is None:
+            yield from self.text.split("\n")
+        else:
+            yield from self._lines
+
+
+def _entry_path(url: str) -> Path:
+    import hashlib
+
+    return cache_path / (hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+
+def _read_entry(url: str) -> dict | None:
+    path = _entry_path(url)
+    try:
+        with open(path, "r") as f:
+            entry = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if entry.get("url") != url:
+        return None
+    return entry
+
+
+def _write_entry(url: str, entry: dict) -> None:
+    import tempfile
+
+    cache_path.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_path, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp, _entry_path(url))
+    _evict()
+
+
+def _touch(url: str) -> None:
+    try:
+        os.utime(_entry_path(url))
+    except FileNotFoundError:
+        pass
+
+
+def _evict() -> None:
+    # Entries are touched on every hit, so the oldest mtime is the least recently used
+    max_bytes = settingsLib.get("http_cache_max_bytes")
+    entries = []
+    total = 0
+    for e in os.scandir(cache_path):
+        if not e.name.endswith(".json"):
+            continue
+        try:
+            st = e.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, e.path))
+        total += st.st_size
+    if total <= max_bytes:
+        return
+    entries.sort()
+    for _, size, path in entries:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        if total <= max_bytes:
+            break
+
+
+def _validators(entry: dict | None) -> dict:
+    headers = {}
+    if entry is not None:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def cached_get(url: str) -> CachedResponse:
+    entry = _read_entry(url) if use_cache else None
+
+    response = get(url, headers=_validators(entry))
+
+    if response.status_code == 304 and entry is not None:
+        _touch(url)
+        return CachedResponse(url, 200, entry["body"], True)
+
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if (
+        use_cache
+        and response.status_code == 200
+        and (etag is not None or last_modified is not None)
+    ):
+        _write_entry(
+            url,
+            {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "body": response.text,
+            },
+        )
+    return CachedResponse(url, response.status_code, response.text, False)
+
+
+def _store_page(url: str, response, text: str) -> None:
+    with _pages_lock:
+        _pages[url] = text
+    if use_cache:
+        _write_entry(
+            url,
+            {
+                "url": url,
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "body": text,
+                "fetched": time.time(),
+            },
+        )
+
+
+class _Stream:
+    # Lines of a streamed page, only cached if it's read to the end. Threads waiting for
+    # the page are let go once it's finished, closed or dropped
+    def __init__(self, url: str, response, claimed: bool):
+        self.url = url
+        self.response = response
+        self.claimed = claimed
+        self.lines: list[str] = []
+        self.closed = False
+        if response.encoding is None:
+            response.encoding = "utf-8"
+        self._lines = response.iter_lines(decode_unicode=True)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        try:
+            line = next(self._lines)
+        except StopIteration:
+            try:
+                _store_page(self.url, self.response, "\n".join(self.lines))
+            finally:
+                self.close()
+            raise
+        except BaseException:
+            self.close()
+            raise
+        self.lines.append(line)
+        return line
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.response.close()
+            if self.claimed:
+                _release(self.url)
+
+    def __del__(self):
+        self.close()
+
+
+def _claim(url: str) -> tuple[str | None, bool]:
+    # The page if this process already has it. Otherwise waits while another thread
+    # fetches it, then claims the fetch if that didn't get it. The bool is whether this
+    # call claimed it and has to _release it
+    while True:
+        with _pages_lock:
+            if url in _pages:
+                return _pages[url], False
+            fetching = _fetching.get(url)
+            if fetching is None:
+                _fetching[url] = (threading.get_ident(), threading.Event())
+                return None, True
+            if fetching[0] == threading.get_ident():
+                # This thread is still streaming it, waiting would never end
+                return None, False
+        fetching[1].wait()
+
+
+def _release(url: str) -> None:
+    with _pages_lock:
+        fetching = _fetching.pop(url, None)
+    if fetching is not None:
+        fetching[1].set()
+
+
+def cached_page(url: str, stream: bool = False) -> CachedResponse:
+    # Pages younger than page_cache_ttl are reused without asking the server, older ones
+    # (or any, with refresh) are revalidated. Streamed pages arrive line by line. Threads
+    # asking for a page another thread is fetching wait for that instead of fetching it
+    text, claimed = _claim(url)
+    if text is not None:
+        return CachedResponse(url, 200, text, True)
+    streaming = False
+    try:
+        entry = _read_entry(url) if use_cache else None
+        if (
+            entry is not None
+            and not refresh
+            and time.time() - entry.get("fetched", 0)
+            < settingsLib.get("page_cache_ttl")
+        ):
+            _touch(url)
+            with _pages_lock:
+                _pages[url] = entry["body"]
+            return CachedResponse(url, 200, entry["body"], True)
+
+        response = get(url, headers=_validators(entry), stream=stream)
+        if response.status_code == 304 and entry is not None:
+            response.close()
+            entry["fetched"] = time.time()
+            _write_entry(url, entry)
+            with _pages_lock:
+                _pages[url] = entry["body"]
+            return CachedResponse(url, 200, entry["body"], True)
+        if response.status_code != 200:
+            response.close()
+            return CachedResponse(url, response.status_code, None, False)
+        if stream:
+            streaming = True
+            return CachedResponse(url, 200, None, False, _Stream(url, response, claimed))
+        _store_page(url, response, response.text)
+        return CachedResponse(url, 200, response.text, False)
+    finally:
+        # A streamed page is released by its _Stream
+        if claimed and not streaming:
+            _release(url)
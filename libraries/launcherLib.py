@@ -34,7 +34,7 @@ def add_categories(package: str, new_categories: list[str]) -> None:
             c_list = list(set(old_categories + new_categories))
             lines[i] = "Categories=" + (";".join(c_list) + ";")
             if install.source.kind == "manual":
-                sourcesLib.update_categories(install.package_name, c_list)
+                sourcesLib.add_categories(install.package_name, new_categories)
             found_category_line = True
     launcher_contents = "\n".join(lines)
     if not found_category_line:
@@ -71,7 +71,7 @@ def remove_categories(package: str, new_categories: list[str]) -> None:
             c_list = list(set(old_categories).difference(new_categories))
             lines[i] = "Categories=" + (";".join(c_list) + ";")
             if install.source.kind == "manual":
-                sourcesLib.update_categories(install.package_name, c_list)
+                sourcesLib.remove_categories(install.package_name, new_categories)
             found_category_line = True
     launcher_contents = "\n".join(lines)
     if not found_category_line:
@@ -1,31 +1,11 @@
-from pathlib import Path
-import sqlite3
+from typing import Iterator
 import json
 
+from libraries import databaseLib
+from libraries import versionLib
 from libraries.dataClasses import Candidate, Installation
 
-db_path = Path("~/.fluffpkg/database.sqlite3").expanduser()
-
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
-
-cursor.execute(
-    """
-CREATE TABLE IF NOT EXISTS installed (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    package_name TEXT UNIQUE NOT NULL,
-    name TEXT,
-    version TEXT,
-    launcher BOOL,
-    path BOOL,
-    module TEXT,
-    source TEXT,
-    executable_path TEXT,
-    version_locked BOOL
-)
-"""
-)
-conn.commit()
+_COLUMNS = "package_name, name, version, launcher, path, module, source, executable_path, version_locked, sha256"
 
 
 def mark_installed(
@@ -33,9 +13,10 @@ def mark_installed(
     version: str,
     executable_path: str,
     version_locked: bool = False,
+    sha256: str | None = None,
 ):
-    cursor.execute(
-        "INSERT INTO installed (package_name, name, version, launcher, path, module, source, executable_path, version_locked) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+    databaseLib.execute(
+        "INSERT INTO installed (package_name, name, version, launcher, path, module, source, executable_path, version_locked, sha256) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
         (
             candidate.package_name,
             candidate.name,
@@ -46,14 +27,13 @@ def mark_installed(
             candidate.source.__str__(),
             executable_path,
             version_locked,
+            sha256,
         ),
     )
-    conn.commit()
 
 
 def unmark_installed(package: str) -> None:
-    cursor.execute("DELETE FROM installed WHERE package_name = ?", (package,))
-    conn.commit()
+    databaseLib.execute("DELETE FROM installed WHERE package_name = ?", (package,))
 
 
 def check_installed(candidate: Candidate | str) -> bool:
@@ -62,33 +42,116 @@ def check_installed(candidate: Candidate | str) -> bool:
 
 
 def query(package: str) -> None | Installation:
-    cursor.execute("SELECT * FROM installed WHERE package_name = ?", (package,))
-    matches = cursor.fetchall()
-    if len(matches) == 0:
-        return None
-    return Installation(*matches[0][1:])
-
-
-def list() -> list[Installation]:
-    cursor.execute("SELECT * FROM installed")
-    rows = cursor.fetchall()
-    return [Installation(*row[1:]) for row in rows]
+    return databaseLib.execute(
+        f"SELECT {_COLUMNS} FROM installed WHERE package_name = ?",
+        (package,),
+        row_factory=Installation.from_row,
+    ).fetchone()
+
+
+def list_by_source(source: str) -> list[str]:
+    rows = databaseLib.execute(
+        "SELECT package_name FROM installed WHERE source = ?", (source,)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+# version is sorted in Python, by versionLib's order rather than as text
+sort_columns = {
+    "name": "name COLLATE NOCASE",
+    "package": "package_name",
+    "version": None,
+    "module": "module",
+    "source": "source",
+}
+
+
+def _listing(
+    category: str | None, sort: str | None, limit: int | None, offset: int
+) -> tuple[str, tuple]:
+    sql = "SELECT {columns} FROM installed"
+    parameters: tuple = ()
+    if category is not None:
+        # Installs don't keep categories themselves, they come from the package's candidate
+        sql += " WHERE package_name IN (SELECT package_name FROM candidate_categories WHERE category = ? COLLATE NOCASE)"
+        parameters += (category,)
+    if sort == "version":
+        return sql, parameters
+    if sort is not None:
+        sql += " ORDER BY " + sort_columns[sort]
+    if limit is not None or offset != 0:
+        sql += " LIMIT ? OFFSET ?"
+        parameters += (-1 if limit is None else limit, offset)
+    return sql, parameters
+
+
+def iterate(
+    category: str | None = None,
+    sort: str | None = None,
+    limit: int | None = None,
+    offset: int = 0,
+) -> Iterator[Installation]:
+    sql, parameters = _listing(category, sort, limit, offset)
+    rows = databaseLib.execute(
+        sql.format(columns=_COLUMNS), parameters, row_factory=Installation.from_row
+    )
+    if sort != "version":
+        return rows
+    rows = sorted(rows, key=lambda i: versionLib.sort_key(i.version or ""))
+    return iter(rows[offset : None if limit is None else offset + limit])
+
+
+def list_widths(
+    category: str | None = None,
+    sort: str | None = None,
+    limit: int | None = None,
+    offset: int = 0,
+) -> tuple:
+    # Widest value of each column `list --installed` prints, for the same rows iterate() returns
+    sql, parameters = _listing(category, sort, limit, offset)
+    if sort == "version" and (limit is not None or offset != 0):
+        # Which rows are on the page depends on the version order
+        page = [i.package_name for i in iterate(category, sort, limit, offset)]
+        sql = "SELECT {columns} FROM installed WHERE package_name IN (SELECT value FROM json_each(?))"
+        parameters = (json.dumps(page),)
+    return databaseLib.execute(
+        """
+SELECT
+    max(length(name)),
+    max(length(version) + CASE WHEN version_locked THEN 4 ELSE 0 END),
+    max(length(package_name)),
+    max(CASE WHEN launcher THEN 4 ELSE 5 END),
+    max(CASE WHEN path THEN 4 ELSE 5 END),
+    max(length(module)),
+    max(length(source))
+FROM ("""
+        + sql.format(columns=_COLUMNS)
+        + ")",
+        parameters,
+    ).fetchone()
+
+
+def list(
+    category: str | None = None,
+    sort: str | None = None,
+    limit: int | None = None,
+    offset: int = 0,
+) -> list[Installation]:
+    return [*iterate(category, sort, limit, offset)]
 
 
 def mark_attribute(package: str, name: str, value) -> None:
     if name == "launcher":
-        cursor.execute(
+        databaseLib.execute(
             "UPDATE installed SET launcher = ? WHERE package_name = ?",
             (bool(value), package),
         )
-        conn.commit()
         return
     elif name == "path":
-        cursor.execute(
+        databaseLib.execute(
             "UPDATE installed SET path = ? WHERE package_name = ?",
             (bool(value), package),
         )
-        conn.commit()
     else:
         print(
             f"Internal Error: Installation record {name} does not exist or cannot be changed by the mark_attribute function."
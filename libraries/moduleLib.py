@@ -1,46 +1,238 @@
+from pathlib import Path
 from types import FunctionType
-from libraries.dataClasses import Candidate, Installation, Command, PosArg
+import importlib
+import json
+from libraries.dataClasses import (
+    Candidate,
+    Installation,
+    Command,
+    FlagArg,
+    ValueArg,
+    PosArg,
+    PosArgs,
+)
+from libraries.exceptions import (
+    AlreadyNewest,
+    InternalError,
+    NoCandidate,
+    SpecificVersion,
+)
+from libraries import httpLib
+from libraries import versionLib
 
 _API_LIST = {}
-_MODIFICATIONS: dict[str, list[tuple[Command, FunctionType]]] = {}
-_SHOWS: dict[str, list[tuple[Command, FunctionType]]] = {}
-_COMMANDS: list[tuple[Command, FunctionType]] = []
+_MANIFEST: dict[str, dict] = {}
+_MODIFICATIONS: dict[str, list[tuple[Command, FunctionType | None]]] = {}
+_SHOWS: dict[str, list[tuple[Command, FunctionType | None]]] = {}
+_COMMANDS: list[tuple[Command, FunctionType | None]] = []
+_COMMAND_MODULES: dict[str, str] = {}
+
+_ARG_KINDS = {
+    "FlagArg": FlagArg,
+    "ValueArg": ValueArg,
+    "PosArg": PosArg,
+    "PosArgs": PosArgs,
+}
+
+modules_path = Path(__file__).parent.parent / "modules"
 
 
 def register(module: str, funcs: dict) -> None:
-    global _COMMANDS
     _API_LIST[module] = funcs
-    _COMMANDS = _COMMANDS + funcs.get("commands", [])
+    _add_commands(module, funcs.get("commands", []))
+    _add_attributes(module, funcs.get("attributes", []))
+
+
+def _add_commands(
+    module: str, commands: list[tuple[Command, FunctionType | None]]
+) -> None:
+    global _COMMANDS
+    names = [c[0].name for c in commands]
+    _COMMANDS = [c for c in _COMMANDS if c[0].name not in names] + commands
+    for name in names:
+        _COMMAND_MODULES[name] = module
+
+
+def _add_attributes(module: str, attributes: list[tuple]) -> None:
     _MODIFICATIONS[module] = []
     _SHOWS[module] = []
-    for name, help, mod, show in funcs.get("attributes", []):
+    for name, help, mod, show in attributes:
         _MODIFICATIONS[module].append(
             (Command(name, help, args=[PosArg(name, help)]), mod)
         )
         _SHOWS[module].append((Command(name, help, []), show))
 
 
+def load_manifest(manifest_path: str | Path) -> list[str]:
+    # Commands and attributes come from the manifest, the module itself is imported on first use
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return []
+    for module, entry in manifest.items():
+        if module in _API_LIST:
+            continue
+        _MANIFEST[module] = entry
+        _add_commands(
+            module,
+            [
+                (
+                    Command(
+                        c["name"],
+                        c["help"],
+                        [_ARG_KINDS[a.pop("kind")](**a) for a in c["args"]],
+                    ),
+                    None,
+                )
+                for c in entry.get("commands", [])
+            ],
+        )
+        _add_attributes(
+            module,
+            [(a["name"], a["help"], None, None) for a in entry.get("attributes", [])],
+        )
+    return [entry["file"] for entry in manifest.values()]
+
+
+def _api(module: str) -> dict:
+    if module not in _API_LIST and module in _MANIFEST:
+        importlib.import_module(f"modules.{_MANIFEST[module]['file']}")
+    return _API_LIST[module]
+
+
+def _manifest_arg(arg) -> dict:
+    if isinstance(arg, (FlagArg, ValueArg)):
+        fields = {"short": arg.short, "name": arg.name, "help": arg.help}
+    elif isinstance(arg, (PosArg, PosArgs)):
+        fields = {"name": arg.name, "help": arg.help, "optional": arg.optional}
+    else:
+        raise InternalError(f"Module command argument can't go in the manifest: {arg}")
+    return {"kind": type(arg).__name__, **fields}
+
+
+def build_manifest() -> dict:
+    for path in sorted(modules_path.glob("*.py")):
+        if path.name != "__init__.py":
+            importlib.import_module(f"modules.{path.stem}")
+    manifest = {}
+    for module, funcs in _API_LIST.items():
+        hooks = [k for k in funcs.keys() if k not in ("commands", "attributes")]
+        manifest[module] = {
+            "file": funcs[hooks[0]].__module__.rsplit(".", 1)[-1],
+            "hooks": hooks,
+            "commands": [
+                {
+                    "name": c.name,
+                    "help": c.help,
+                    "args": [_manifest_arg(a) for a in c.args],
+                }
+                for c, _ in funcs.get("commands", [])
+            ],
+            "attributes": [
+                {"name": name, "help": help}
+                for name, help, _, _ in funcs.get("attributes", [])
+            ],
+        }
+    return manifest
+
+
+def write_manifest() -> None:
+    manifest = build_manifest()
+    with open(modules_path / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=4)
+        f.write("\n")
+
+
 def install(module: str, candidate: Candidate, cmd_args: dict):
-    _API_LIST[module]["install"](candidate, cmd_args)
+    _api(module)["install"](candidate, cmd_args)
 
 
 def remove(module: str, installation: Installation, cmd_args: dict) -> None:
-    _API_LIST[module]["remove"](installation, cmd_args)
+    _api(module)["remove"](installation, cmd_args)
+
+
+def check_latest(
+    module: str, installation: Installation, candidate: Candidate, cmd_args: dict
+) -> dict:
+    return _api(module)["check_latest"](installation, candidate, cmd_args)
+
+
+def apply_upgrade(
+    module: str,
+    installation: Installation,
+    candidate: Candidate,
+    latest: dict,
+    cmd_args: dict,
+) -> None:
+    _api(module)["apply_upgrade"](installation, candidate, latest, cmd_args)
 
 
 def upgrade(module: str, installation: Installation, cmd_args: dict) -> None:
-    _API_LIST[module]["upgrade"](installation, cmd_args)
+    # Modules from before check_latest/apply_upgrade check and upgrade in one go
+    _api(module)["upgrade"](installation, cmd_args, data=None)
+
+
+def plan_upgrade(
+    installation: Installation,
+    candidate: Candidate | None,
+    cmd_args: dict,
+    latest: dict | None = None,
+) -> dict:
+    if installation.version_locked and not cmd_args["--force"]:
+        raise SpecificVersion()
+    if candidate is None:
+        raise NoCandidate()
+    if latest is None:
+        latest = check_latest(installation.module, installation, candidate, cmd_args)
+    if not versionLib.is_newer(
+        latest["version"],
+        installation.version,
+        candidate.module_data.get("version_scheme"),
+    ):
+        raise AlreadyNewest(installation.package_name)
+    return latest
+
+
+def check_all(
+    checks: list[tuple[Installation, Candidate]], cmd_args: dict, workers: int
+) -> dict[str, dict | Exception]:
+    # Only the network half runs in the pool, database access stays on the main thread
+    results: dict[str, dict | Exception] = {}
+    if len(checks) == 0:
+        return results
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    for installation, _ in checks:
+        _api(installation.module)
+    workers = max(1, min(workers, len(checks)))
+    httpLib.reserve_connections(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                check_latest, installation.module, installation, candidate, cmd_args
+            ): installation.package_name
+            for installation, candidate in checks
+        }
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = e
+    return results
 
 
 def versions(module: str, candidate: Candidate, cmd_args: dict) -> None:
-    _API_LIST[module]["versions"](candidate, cmd_args)
+    _api(module)["versions"](candidate, cmd_args)
 
 
 def execpath(module: str, installation: Installation, cmd_args: dict) -> None:
-    _API_LIST[module]["execpath"](installation, cmd_args)
+    _api(module)["execpath"](installation, cmd_args)
 
 
 def hasCommand(module: str, command: str) -> bool:
+    if module not in _API_LIST and module in _MANIFEST:
+        return command in _MANIFEST[module]["hooks"]
     return command in _API_LIST[module].keys()
 
 
@@ -65,11 +257,13 @@ def showNames(module: str) -> list[str]:
 
 
 def modify(package: str, module: str, attribute: str, newval: str) -> None:
+    _api(module)
     mod = [m[1] for m in _MODIFICATIONS[module] if m[0].name == attribute][0]
     mod(package, newval)
 
 
 def show(package: str, module: str, attribute: str) -> None:
+    _api(module)
     sho = [s[1] for s in _SHOWS[module] if s[0].name == attribute][0]
     sho(package)
 
@@ -79,5 +273,6 @@ def getCommands() -> list[Command]:
 
 
 def command(command: str, cmd_args: dict) -> None:
+    _api(_COMMAND_MODULES[command])
     cmd = [c[1] for c in _COMMANDS if c[0].name == command][0]
     cmd(cmd_args)
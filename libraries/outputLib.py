@@ -0,0 +1,89 @@
+from typing import Iterable
+import json
+import os
+import sys
+
+formats = ("ndjson", "json", "tsv")
+
+
+def _cell(value) -> str:
+    return "" if value is None else str(value)
+
+
+def _tsv_cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, dict)):
+        value = json.dumps(value)
+    return (
+        str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+    )
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (str, int, float, bool, list, dict)):
+        return value
+    return str(value)
+
+
+def _closed_pipe() -> None:
+    # Piped into something like head, which stopped reading
+    os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    exit()
+
+
+def print_records(format: str, fields: list[str], rows: Iterable[list]) -> None:
+    # One record per line, printed as soon as its row is read. json is an array with
+    # an element per line, printed one row behind so the last one gets no comma
+    try:
+        if format == "tsv":
+            print("\t".join(fields))
+        elif format == "json":
+            print("[")
+        previous = None
+        for row in rows:
+            if format == "tsv":
+                print("\t".join(_tsv_cell(v) for v in row))
+                continue
+            record = json.dumps(dict(zip(fields, (_json_value(v) for v in row))))
+            if format == "ndjson":
+                print(record)
+                continue
+            if previous is not None:
+                print(previous + ",")
+            previous = record
+        if format == "json":
+            if previous is not None:
+                print(previous)
+            print("]")
+        sys.stdout.flush()
+    except BrokenPipeError:
+        _closed_pipe()
+
+
+def plain_table(rows: list[list[str]]) -> str:
+    # Laid out like tabulate's "plain" format, without importing it
+    widths = [max(len(str(v)) for v in column) for column in zip(*rows)]
+    return "\n".join(
+        "  ".join(str(v).ljust(w) for v, w in zip(row, widths)).rstrip()
+        for row in rows
+    )
+
+
+def print_table(
+    headers: list[str], widths: Iterable[int | None], rows: Iterable[list]
+) -> None:
+    # Widths are known before the first row, so each row is printed as soon as it's read
+    widths = [max(w or 0, len(h)) for w, h in zip(widths, headers)]
+    try:
+        print("  ".join(h.ljust(w) for h, w in zip(headers, widths)).rstrip())
+        print("  ".join("-" * w for w in widths))
+        for row in rows:
+            print(
+                "  ".join(_cell(v).ljust(w) for v, w in zip(row, widths)).rstrip()
+            )
+        sys.stdout.flush()
+    except BrokenPipeError:
+        _closed_pipe()
@@ -13,6 +13,7 @@ def add_path(package: str):
         exit()
 
     destination = Path("~/.fluffpkg/bin/").expanduser() / package
+    destination.parent.mkdir(parents=True, exist_ok=True)
     destination.symlink_to(install.executable_path)
     manageInstalledLib.mark_attribute(package, "path", True)
     pathwarn()
@@ -0,0 +1,35 @@
+from pathlib import Path
+import json
+
+settings_path = Path("~/.fluffpkg/settings.json").expanduser()
+
+_DEFAULTS = {
+    "upgrade_workers": 8,
+    "http_cache_max_bytes": 32 * 1024 * 1024,
+    "http_timeout": 30,
+    "http_retries": 3,
+    "download_attempts": 5,
+    "download_chunk_size": 81920,
+    "download_segments": 4,
+    "download_segment_min_bytes": 16 * 1024 * 1024,
+    "dotdeb_timings": False,
+    "page_cache_ttl": 600,
+}
+
+_settings: dict | None = None
+
+
+def load() -> dict:
+    # Built before it's published, so upgrade check threads never see it half loaded
+    global _settings
+    if _settings is None:
+        settings = {}
+        if settings_path.is_file():
+            with open(settings_path, "r") as f:
+                settings = json.load(f)
+        _settings = settings
+    return _settings
+
+
+def get(name: str):
+    return load().get(name, _DEFAULTS[name])
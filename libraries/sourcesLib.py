@@ -1,6 +1,8 @@
 from pathlib import Path
-import sqlite3
+from typing import Iterator
+import hashlib
 import json
+import re
 
 from libraries.exceptions import (
     MultipleCandidates,
@@ -9,37 +11,10 @@ from libraries.exceptions import (
     SourceNotFound,
 )
 from libraries.dataClasses import Candidate, QueryResult, Source
-from libraries import manageInstalledLib
-
-db_path = Path("~/.fluffpkg/database.sqlite3").expanduser()
-
-conn = sqlite3.connect(db_path)
-cursor = conn.cursor()
-
-cursor.execute(
-    """
-CREATE TABLE IF NOT EXISTS candidates (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    module TEXT,
-    name TEXT,
-    package_name TEXT UNIQUE NOT NULL,
-    categories TEXT,
-    source TEXT,
-    download_url TEXT,
-    module_data TEXT
-)
-"""
-)
-cursor.execute(
-    """
-CREATE TABLE IF NOT EXISTS sources (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    kind TEXT,
-    url TEXT
-)
-"""
-)
-conn.commit()
+from libraries import databaseLib, manageInstalledLib, outputLib
+
+_COLUMNS = "module, name, package_name, categories, source, download_url, module_data"
+_POSTINGS = 2000
 
 
 def get_source(package: str) -> Candidate | None:
@@ -48,78 +23,165 @@ def get_source(package: str) -> Candidate | None:
     if original_source is None:
         return None
     if len(original_source.candidates) != 1:
-        candidates = [
-            c for c in original_source.candidates if c.source == "github-appimage"
-        ]
-        if len(candidates) != 1:
+        original_source = query(package, module="github-appimage")
+        if original_source is None or len(original_source.candidates) != 1:
             raise MultipleCandidates()
-        candidate = candidates[0]
-    else:
-        candidate = original_source.candidates[0]
-    return candidate
+    return original_source.candidates[0]
 
 
-def query(package: str) -> None | QueryResult:
-    cursor.execute("SELECT * FROM candidates WHERE package_name = ?", (package,))
-    matches = cursor.fetchall()
+def query(package: str, module: str | None = None) -> None | QueryResult:
+    matches = databaseLib.execute(
+        f"SELECT {_COLUMNS} FROM candidates WHERE package_name = ?",
+        (package,),
+        row_factory=Candidate.from_row,
+    ).fetchall()
     if len(matches) != 0:
-        return QueryResult("found", [Candidate(*match[1:]) for match in matches])
+        return QueryResult("found", matches)
 
-    cursor.execute(
-        "SELECT * FROM candidates WHERE package_name LIKE ? OR name LIKE ?",
-        ("%" + package + "%", "%" + package + "%"),
-    )
-    matches = cursor.fetchall()
+    matches = search([package], module=module, limit=10)
     if len(matches) != 0:
-        return QueryResult(
-            "strong_recommend", [Candidate(*match[1:]) for match in matches]
-        )
+        return QueryResult("strong_recommend", matches)
 
     return None
 
 
+def _match_expression(terms: list[str]) -> str:
+    # Every word has to match the start of a word, quoted so user input is never FTS syntax
+    words = [w for term in terms for w in re.findall(r"\w+", term)]
+    return " ".join('"' + w.replace('"', '""') + '"*' for w in words)
+
+
+def search(
+    terms: list[str], module: str | None = None, limit: int = 20
+) -> list[Candidate]:
+    expression = _match_expression(terms)
+    if expression == "":
+        return []
+    columns = ", ".join("c." + c for c in _COLUMNS.split(", "))
+    sql = f"SELECT {columns} FROM candidates_fts JOIN candidates c ON c.id = candidates_fts.rowid WHERE candidates_fts MATCH ?"
+    parameters: tuple = (expression,)
+    if module is not None:
+        sql += " AND c.module = ?"
+        parameters += (module,)
+    # Names weigh more than package names, categories only break ties
+    return databaseLib.execute(
+        sql + " ORDER BY bm25(candidates_fts, 10.0, 5.0, 1.0) LIMIT ?",
+        parameters + (limit,),
+        row_factory=Candidate.from_row,
+    ).fetchall()
+
+
+def _trigrams(text: str) -> set[str]:
+    # Same as the database side, whose lower() only folds ASCII
+    text = "  " + "".join(c.lower() if c.isascii() else c for c in text) + " "
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def _similarity(a: set[str], b: set[str]) -> float:
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def suggest(package: str, limit: int = 5) -> list[Candidate]:
+    # The index narrows things down to the candidates sharing the most trigrams, only
+    # those are scored properly. Reading at most _POSTINGS rows per trigram keeps common
+    # ones like " li" from costing a pass over every candidate.
+    trigrams = sorted(_trigrams(package[:64]))
+    postings = " UNION ALL ".join(
+        "SELECT * FROM (SELECT candidate_id FROM candidate_trigrams WHERE trigram = ? LIMIT ?)"
+        for _ in trigrams
+    )
+    columns = ", ".join("c." + c for c in _COLUMNS.split(", "))
+    rows = databaseLib.execute(
+        f"""
+SELECT {columns} FROM (
+    SELECT candidate_id, count(*) AS shared FROM ({postings})
+    GROUP BY candidate_id ORDER BY shared DESC LIMIT ?
+) t JOIN candidates c ON c.id = t.candidate_id
+""",
+        tuple(p for t in trigrams for p in (t, _POSTINGS)) + (limit * 10,),
+        row_factory=Candidate.from_row,
+    ).fetchall()
+    scored = []
+    for candidate in rows:
+        score = max(
+            _similarity(set(trigrams), _trigrams(candidate.package_name)),
+            _similarity(set(trigrams), _trigrams(candidate.name or "")),
+        )
+        if score >= 0.3:
+            scored.append((score, candidate))
+    scored.sort(key=lambda s: s[0], reverse=True)
+    return [candidate for _, candidate in scored[:limit]]
+
+
 def check_existing_source(package: str) -> bool:
-    q = query(package)
-    return type(q) is QueryResult and q.kind == "found"
+    row = databaseLib.execute(
+        "SELECT 1 FROM candidates WHERE package_name = ?", (package,)
+    ).fetchone()
+    return row is not None
+
+
+def _candidate_row(candidate: Candidate) -> tuple:
+    row = (
+        candidate.module,
+        candidate.name,
+        candidate.package_name,
+        json.dumps(candidate.categories),
+        f"{candidate.source.kind}:{candidate.source.url}",
+        candidate.download_url,
+        json.dumps(candidate.module_data, sort_keys=True),
+    )
+    return row + (hashlib.sha256(json.dumps(row).encode()).hexdigest(),)
+
+
+def _insert_candidates(rows: list[tuple]) -> int:
+    # Rows from _candidate_row, returns how many were added. Their trigrams are worked out
+    # here and added in one batch, which is cheaper than the insert trigger's query per row
+    with databaseLib.transaction():
+        first = databaseLib.execute(
+            "SELECT coalesce(max(id), 0) FROM candidates"
+        ).fetchone()[0]
+        databaseLib.execute("INSERT INTO candidate_trigrams_deferred VALUES (1)")
+        try:
+            databaseLib.executemany(
+                "INSERT INTO candidates (module, name, package_name, categories, source, download_url, module_data, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(package_name) DO NOTHING",
+                rows,
+            )
+        finally:
+            databaseLib.execute("DELETE FROM candidate_trigrams_deferred")
+        added = databaseLib.execute(
+            "SELECT id, package_name, name FROM candidates WHERE id > ?", (first,)
+        ).fetchall()
+        databaseLib.executemany(
+            "INSERT OR IGNORE INTO candidate_trigrams (trigram, candidate_id) VALUES (?, ?)",
+            (
+                (trigram, candidate_id)
+                for candidate_id, package_name, name in added
+                for trigram in _trigrams(package_name)
+                | (set() if name is None else _trigrams(name))
+            ),
+        )
+    return len(added)
 
 
 def add_candidate(
-    candidate: Candidate, update: bool = False, update_source: str = ""
+    candidate: Candidate,
+    update: bool = False,
+    update_source: str = "",
+    failExists: bool = True,
 ) -> None:
     if update:
-        cursor.execute(
-            "UPDATE candidates SET module = ?, name = ?, package_name = ?, categories = ?, source = ?, download_url = ?, module_data = ? WHERE source = ? AND package_name = ?",
-            (
-                candidate.module,
-                candidate.name,
-                candidate.package_name,
-                json.dumps(candidate.categories),
-                f"{candidate.source.kind}:{candidate.source.url}",
-                candidate.download_url,
-                json.dumps(candidate.module_data),
-                update_source,
-                candidate.package_name,
-            ),
+        databaseLib.execute(
+            "UPDATE candidates SET module = ?, name = ?, package_name = ?, categories = ?, source = ?, download_url = ?, module_data = ?, content_hash = ? WHERE source = ? AND package_name = ?",
+            _candidate_row(candidate) + (update_source, candidate.package_name),
         )
-        conn.commit()
     else:
-        if check_existing_source(candidate.package_name):
+        inserted = databaseLib.execute(
+            "INSERT INTO candidates (module, name, package_name, categories, source, download_url, module_data, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(package_name) DO NOTHING",
+            _candidate_row(candidate),
+        ).rowcount
+        if inserted == 0 and failExists:
             raise AlreadySourced(candidate.package_name)
 
-        cursor.execute(
-            "INSERT INTO candidates (module, name, package_name, categories, source, download_url, module_data) VALUES (?, ?, ?, ?, ?, ?, ?)",
-            (
-                candidate.module,
-                candidate.name,
-                candidate.package_name,
-                json.dumps(candidate.categories),
-                f"{candidate.source.kind}:{candidate.source.url}",
-                candidate.download_url,
-                json.dumps(candidate.module_data),
-            ),
-        )
-        conn.commit()
-
 
 def remove_candidate(package: str) -> None:
     if not check_existing_source(package):
@@ -129,43 +191,115 @@ def remove_candidate(package: str) -> None:
         print(f"Cannot remove installation candidate for installed package '{package}'")
         exit()
 
-    cursor.execute(
+    databaseLib.execute(
         "DELETE FROM candidates WHERE package_name = ?",
         (package,),
     )
-    conn.commit()
-
-
-def update_categories(package: str, categories: list[str]) -> None:
-    cursor.execute(
-        "UPDATE candidates SET categories = ? WHERE package_name = ?",
-        (json.dumps(categories), package),
-    )
-    conn.commit()
 
 
 # def get_module_data(package: str):
-#     cursor.execute(
+#     db().execute(
 #         "SELECT module_data FROM candidates WHERE package_name = ?",
 #         (package,),
 #     )
-#     match = cursor.fetchall()[0][0]
+#     match = db().fetchall()[0][0]
 #     match = {} if match is None else json.loads(match)
 #     return match
 
 
 def set_module_data(package: str, module_data: dict) -> None:
-    cursor.execute(
+    databaseLib.execute(
         "UPDATE candidates SET module_data = ? WHERE package_name = ?",
         (json.dumps(module_data), package),
     )
-    conn.commit()
 
 
-def list() -> list[Candidate]:
-    cursor.execute("SELECT * FROM candidates")
-    rows = cursor.fetchall()
-    return [Candidate(*row[1:]) for row in rows]
+def _store_categories(package: str) -> None:
+    databaseLib.execute(
+        "UPDATE candidates SET categories = (SELECT json_group_array(category) FROM candidate_categories WHERE package_name = ?) WHERE package_name = ?",
+        (package, package),
+    )
+
+
+def add_categories(package: str, categories: list[str]) -> None:
+    if not check_existing_source(package):
+        return
+    with databaseLib.transaction():
+        databaseLib.executemany(
+            "INSERT OR IGNORE INTO candidate_categories (package_name, category) VALUES (?, ?)",
+            [(package, category) for category in categories],
+        )
+        _store_categories(package)
+
+
+def remove_categories(package: str, categories: list[str]) -> None:
+    with databaseLib.transaction():
+        databaseLib.executemany(
+            "DELETE FROM candidate_categories WHERE package_name = ? AND category = ?",
+            [(package, category) for category in categories],
+        )
+        _store_categories(package)
+
+
+sort_columns = {
+    "name": "name COLLATE NOCASE",
+    "package": "package_name",
+    "module": "module",
+    "source": "source",
+}
+
+
+def _listing(
+    category: str | None, sort: str | None, limit: int | None, offset: int
+) -> tuple[str, tuple]:
+    sql = "SELECT {columns} FROM candidates"
+    parameters: tuple = ()
+    if category is not None:
+        sql += " WHERE package_name IN (SELECT package_name FROM candidate_categories WHERE category = ? COLLATE NOCASE)"
+        parameters += (category,)
+    if sort is not None:
+        sql += " ORDER BY " + sort_columns[sort]
+    if limit is not None or offset != 0:
+        sql += " LIMIT ? OFFSET ?"
+        parameters += (-1 if limit is None else limit, offset)
+    return sql, parameters
+
+
+def iterate(
+    category: str | None = None,
+    sort: str | None = None,
+    limit: int | None = None,
+    offset: int = 0,
+) -> Iterator[Candidate]:
+    sql, parameters = _listing(category, sort, limit, offset)
+    return databaseLib.execute(
+        sql.format(columns=_COLUMNS), parameters, row_factory=Candidate.from_row
+    )
+
+
+def list_widths(
+    category: str | None = None,
+    sort: str | None = None,
+    limit: int | None = None,
+    offset: int = 0,
+) -> tuple:
+    # Widest name, package name, module and source of the same rows iterate() returns
+    sql, parameters = _listing(category, sort, limit, offset)
+    return databaseLib.execute(
+        "SELECT max(length(name)), max(length(package_name)), max(length(module)), max(length(source)) FROM ("
+        + sql.format(columns="name, package_name, module, source")
+        + ")",
+        parameters,
+    ).fetchone()
+
+
+def list(
+    category: str | None = None,
+    sort: str | None = None,
+    limit: int | None = None,
+    offset: int = 0,
+) -> list[Candidate]:
+    return iterate(category, sort, limit, offset).fetchall()
 
 
 def add_source(sourcepath: str) -> None:
@@ -185,21 +319,8 @@ def add_source(sourcepath: str) -> None:
 
         source = Source("local", sourcepath)
 
-    cursor.execute(
-        "SELECT * FROM sources WHERE kind = ? AND url = ?", (source.kind, source.url)
-    )
-    rows = cursor.fetchall()
-    if len(rows) != 0:
-        raise SourceAlreadyExists()
-
-    cursor.execute(
-        "INSERT INTO sources (kind, url) VALUES (?, ?)",
-        (source.kind, source.url),
-    )
-    conn.commit()
-
-    for item in new_source_data:
-        candidate = Candidate(
+    candidates = [
+        Candidate(
             item["module"],
             item["name"],
             item["package_name"],
@@ -208,12 +329,46 @@ def add_source(sourcepath: str) -> None:
             item["download_url"],
             item["module_data"],
         )
-        try:
-            add_candidate(candidate)
-        except AlreadySourced:
-            print(
-                f"Skipping package {candidate.package_name} which already has a source"
+        for item in new_source_data
+    ]
+
+    with databaseLib.transaction():
+        row = databaseLib.execute(
+            "SELECT 1 FROM sources WHERE kind = ? AND url = ?",
+            (source.kind, source.url),
+        ).fetchone()
+        if row is not None:
+            raise SourceAlreadyExists()
+
+        databaseLib.execute(
+            "INSERT INTO sources (kind, url) VALUES (?, ?)",
+            (source.kind, source.url),
+        )
+
+        # One indexed lookup for every name in the file instead of a query per package
+        seen = {
+            r[0]
+            for r in databaseLib.execute(
+                "SELECT value FROM json_each(?) WHERE value IN (SELECT package_name FROM candidates)",
+                (json.dumps([c.package_name for c in candidates]),),
             )
+        }
+        rows = []
+        skipped = []
+        for candidate in candidates:
+            if candidate.package_name in seen:
+                skipped.append(candidate.package_name)
+                continue
+            seen.add(candidate.package_name)
+            rows.append(_candidate_row(candidate))
+
+        _insert_candidates(rows)
+
+    print(f"Added {len(rows)} packages from {source.url}")
+    if len(skipped) != 0:
+        print(f"Skipped {len(skipped)} packages which already have a source:")
+        for package in skipped:
+            print("   ", package)
 
 
 def remove_source(sourcepath: str) -> None:
@@ -222,34 +377,35 @@ def remove_source(sourcepath: str) -> None:
         exit()
     try:
         _id = int(sourcepath)
-        cursor.execute("SELECT kind, url FROM sources WHERE id = ?", (_id,))
+        rows = databaseLib.execute(
+            "SELECT kind, url FROM sources WHERE id = ?", (_id,)
+        ).fetchall()
     except ValueError:
-        cursor.execute("SELECT kind, url FROM sources WHERE url = ?", (sourcepath,))
-
-    rows = cursor.fetchall()
+        rows = databaseLib.execute(
+            "SELECT kind, url FROM sources WHERE url = ?", (sourcepath,)
+        ).fetchall()
     if len(rows) == 0:
         raise SourceNotFound(sourcepath)
 
     source = Source(*rows[0])
     source_string = str(source)
 
-    cursor.execute(
-        "SELECT package_name FROM installed WHERE source = ?", (source_string,)
-    )
-    rows = cursor.fetchall()
-    if len(rows) != 0:
+    dependents = manageInstalledLib.list_by_source(source_string)
+    if len(dependents) != 0:
         print("Could not remove source, packages depend on it:")
-        for r in rows:
-            print("   ", r[0])
+        for package in dependents:
+            print("   ", package)
         exit()
 
-    try:
-        _id = int(sourcepath)
-        cursor.execute("DELETE FROM sources WHERE id = ?", (_id,))
-    except ValueError:
-        cursor.execute("DELETE FROM sources WHERE url = ?", (sourcepath,))
-    cursor.execute("DELETE FROM candidates WHERE source = ?", (source_string,))
-    conn.commit()
+    with databaseLib.transaction():
+        try:
+            _id = int(sourcepath)
+            databaseLib.execute("DELETE FROM sources WHERE id = ?", (_id,))
+        except ValueError:
+            databaseLib.execute("DELETE FROM sources WHERE url = ?", (sourcepath,))
+        databaseLib.execute(
+            "DELETE FROM candidates WHERE source = ?", (source_string,)
+        )
 
 
 def update_source(sourcepath: str) -> None:
@@ -258,10 +414,13 @@ def update_source(sourcepath: str) -> None:
         exit()
     try:
         _id = int(sourcepath)
-        cursor.execute("SELECT kind, url FROM sources WHERE id = ?", (_id,))
+        rows = databaseLib.execute(
+            "SELECT kind, url FROM sources WHERE id = ?", (_id,)
+        ).fetchall()
     except ValueError:
-        cursor.execute("SELECT kind, url FROM sources WHERE url = ?", (sourcepath,))
-    rows = cursor.fetchall()
+        rows = databaseLib.execute(
+            "SELECT kind, url FROM sources WHERE url = ?", (sourcepath,)
+        ).fetchall()
     if len(rows) == 0:
         raise SourceNotFound(sourcepath)
 
@@ -280,6 +439,8 @@ def update_source(sourcepath: str) -> None:
         print("Unhandled source kind (for updates):", source.kind)
         exit()
 
+    source_string = str(source)
+    candidates = {}
     for item in new_source_data:
         candidate = Candidate(
             item["module"],
@@ -290,12 +451,51 @@ def update_source(sourcepath: str) -> None:
             item["download_url"],
             item["module_data"],
         )
-        add_candidate(candidate, update=True, update_source=str(source))
-    print("Source updated")
+        candidates[candidate.package_name] = _candidate_row(candidate)
+
+    with databaseLib.transaction():
+        stored = dict(
+            databaseLib.execute(
+                "SELECT package_name, content_hash FROM candidates WHERE source = ?",
+                (source_string,),
+            ).fetchall()
+        )
+        inserts = [row for name, row in candidates.items() if name not in stored]
+        updates = [
+            row[:2] + row[3:] + (name,)
+            for name, row in candidates.items()
+            if name in stored and stored[name] != row[-1]
+        ]
+        installed = set(manageInstalledLib.list_by_source(source_string))
+        deletes = [name for name in stored if name not in candidates]
+        kept = [name for name in deletes if name in installed]
+        deletes = [(name,) for name in deletes if name not in installed]
+
+        added = _insert_candidates(inserts)
+        databaseLib.executemany(
+            "UPDATE candidates SET module = ?, name = ?, categories = ?, source = ?, download_url = ?, module_data = ?, content_hash = ? WHERE package_name = ?",
+            updates,
+        )
+        databaseLib.executemany(
+            "DELETE FROM candidates WHERE package_name = ?",
+            deletes,
+        )
+
+    print(
+        f"Source updated: {added} added, {len(updates)} updated, {len(deletes)} removed"
+    )
+    if added != len(inserts):
+        print(
+            f"Skipped {len(inserts) - added} new packages which already have a source"
+        )
+    for package in kept:
+        print(f"Kept installed package '{package}' which is no longer in the source")
 
 
-def list_sources() -> None:
-    cursor.execute("SELECT id, kind, url FROM sources")
-    rows = cursor.fetchall()
+def list_sources(format: str | None = None) -> None:
+    rows = databaseLib.execute("SELECT id, kind, url FROM sources")
+    if format is not None:
+        outputLib.print_records(format, ["id", "kind", "url"], rows)
+        return
     for r in rows:
         print(f"[{r[0]}] {r[1]} : {r[2]}")
@@ -0,0 +1,92 @@
+from pathlib import Path
+import fcntl
+import hashlib
+import os
+import shutil
+
+from libraries import databaseLib
+from libraries.exceptions import ChecksumMismatch
+
+store_path = Path("~/.fluffpkg/store").expanduser()
+
+# linux/fs.h FICLONE
+_FICLONE = 0x40049409
+
+
+def blob_path(digest: str) -> Path:
+    return store_path / "sha256" / digest[:2] / digest
+
+
+def lookup(url: str) -> str | None:
+    row = databaseLib.execute(
+        "SELECT sha256 FROM artifacts WHERE url = ?", (url,)
+    ).fetchone()
+    if row is None or not blob_path(row[0]).is_file():
+        return None
+    return row[0]
+
+
+def add(url: str, path: Path, digest: str) -> str:
+    blob = blob_path(digest)
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    if blob.exists():
+        path.unlink()
+    else:
+        os.replace(path, blob)
+    databaseLib.execute(
+        "INSERT INTO artifacts (url, sha256, size) VALUES (?, ?, ?) ON CONFLICT(url) DO UPDATE SET sha256 = excluded.sha256, size = excluded.size",
+        (url, digest, blob.stat().st_size),
+    )
+    return digest
+
+
+def link(digest: str, output: Path) -> None:
+    blob = blob_path(digest)
+    output.unlink(missing_ok=True)
+    try:
+        os.link(blob, output)
+        return
+    except OSError:
+        pass
+    # Different filesystem than the store, try a copy-on-write clone before a full copy
+    try:
+        with open(blob, "rb") as src, open(output, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        return
+    except OSError:
+        pass
+    shutil.copyfile(blob, output)
+
+
+def fetch(
+    url: str, output: Path, prettyname: str = "", expected: dict[str, str] = {}
+) -> str:
+    expected = {a: d.lower() for a, d in expected.items() if a in ("sha256", "sha512")}
+    digest = lookup(url)
+    if digest is not None and expected.get("sha256", digest) != digest:
+        print(f"Stored '{prettyname}' doesn't match its published checksum")
+        digest = None
+
+    if digest is not None:
+        print(f"Using stored '{prettyname}'")
+    else:
+        from libraries.downloadLib import download_file
+
+        incoming = store_path / "incoming"
+        incoming.mkdir(parents=True, exist_ok=True)
+        download_path = incoming / hashlib.sha256(url.encode()).hexdigest()
+        _, digests = download_file(
+            url,
+            output=download_path,
+            prettyname=prettyname,
+            algorithms=sorted({"sha256"} | set(expected)),
+        )
+        for algorithm, value in expected.items():
+            if digests[algorithm] != value:
+                download_path.unlink()
+                raise ChecksumMismatch(prettyname, algorithm)
+        if len(expected) != 0:
+            print(f"Verified {', '.join(sorted(expected))} checksum")
+        digest = add(url, download_path, digests["sha256"])
+    link(digest, output)
+    return digest
@@ -1,5 +1,3 @@
-import time
-import requests
 
 
 def user_pick(options: list[str], prompt="Selection"):
@@ -24,18 +22,29 @@ def pathwarn():
         )
 
 
-# https://stackoverflow.com/a/16696317
-def download_file(url: str, output: str | None = None, prettyname: str = "") -> str:
-    timeMark = time.time() + 1
-    print(f"Downloading '{prettyname}' .", end="", flush=True)
-    local_filename = output if output is not None else url.split("/")[-1]
-    with requests.get(url, stream=True) as r:
-        r.raise_for_status()
-        with open(local_filename, "wb") as f:
-            for chunk in r.iter_content(chunk_size=81920):
-                if time.time() > timeMark:
-                    print(".", end="", flush=True)
-                    timeMark = time.time() + 1
-                f.write(chunk)
-    print()
-    return local_filename
+def format_size(size: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return f"{size:.1f} {unit}"
+
+
+def parse_checksums(text: str, filename: str, lone: bool = False) -> dict[str, str]:
+    # Handles sha256sum style "<hash>  <file>" listings. A hash on its own line is only
+    # taken when the caller knows the file is about filename (lone), like <filename>.sha256
+    lengths = {64: "sha256", 128: "sha512"}
+    found = {}
+    for line in text.splitlines():
+        parts = line.strip().split()
+        if len(parts) == 0 or len(parts) > 2:
+            continue
+        digest = parts[0].lower()
+        if len(digest) not in lengths or not all(c in "0123456789abcdef" for c in digest):
+            continue
+        if len(parts) == 1 and not lone:
+            continue
+        if len(parts) == 2 and parts[1].lstrip("*").split("/")[-1] != filename:
+            continue
+        found.setdefault(lengths[len(digest)], digest)
+    return found
@@ -0,0 +1,99 @@
+from functools import lru_cache
+from typing import Iterable
+import re
+
+# Versions are ordered like dpkg orders them: epoch first, then the upstream version and
+# the revision, each compared in alternating runs of non-digits (letters before other
+# characters, ~ before everything, even the end) and digits (numerically). semver
+# prereleases (and -suffixes that don't start with a digit) and calendar dates are
+# rewritten into that form before they're keyed
+
+schemes = ("semver", "calendar", "debian")
+
+_CALENDAR = re.compile(r"^(?:19|20)\d\d([.\-_])\d{1,2}(?:\1\d{1,2})?(?:[.\-_]\d+)*$")
+_SEMVER = re.compile(
+    r"^(\d+\.\d+\.\d+)(?:-([0-9A-Za-z.\-]+))?(?:\+[0-9A-Za-z.\-]+)?$"
+)
+_DEBIAN = re.compile(r"^(?:(\d+):)?(\d[A-Za-z0-9.+~:\-]*)$")
+_RUNS = re.compile(r"([^0-9]*)([0-9]*)")
+
+# What a version that ran out compares as, against the next run of a longer one
+_END = ((0,), 0)
+
+
+def _order(c: str) -> int:
+    if c == "~":
+        return -1
+    if c.isascii() and c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+
+def _runs(text: str) -> tuple:
+    runs = []
+    for chars, digits in _RUNS.findall(text):
+        if chars == "" and digits == "":
+            continue
+        runs.append((tuple(_order(c) for c in chars) + (0,), int(digits or 0)))
+    runs.append(_END)
+    return tuple(runs)
+
+
+def _strip(version: str) -> str:
+    # Tags like v1.2.3
+    return version[1:] if version.startswith(("v", "V")) else version
+
+
+@lru_cache(maxsize=4096)
+def scheme(version: str) -> str | None:
+    version = _strip(version)
+    if _CALENDAR.match(version):
+        return "calendar"
+    if _SEMVER.match(version):
+        return "semver"
+    if _DEBIAN.match(version):
+        return "debian"
+    return None
+
+
+@lru_cache(maxsize=4096)
+def sort_key(version: str, hint: str | None = None) -> tuple:
+    # hint names the scheme when a package knows it, otherwise it's detected. Versions
+    # of no scheme are still keyed by their runs
+    version = _strip(version)
+    kind = hint or scheme(version)
+    epoch = 0
+    revision = ""
+    if kind == "semver":
+        match = _SEMVER.match(version)
+        if match is not None:
+            upstream = match[1] if match[2] is None else f"{match[1]}~{match[2]}"
+        else:
+            upstream = version
+    elif kind == "calendar":
+        upstream = re.sub(r"[\-_]", ".", version)
+    elif kind == "debian":
+        upstream = version
+        if ":" in upstream and upstream.split(":", 1)[0].isdigit():
+            epoch_text, upstream = upstream.split(":", 1)
+            epoch = int(epoch_text)
+        if "-" in upstream:
+            upstream, revision = upstream.rsplit("-", 1)
+            # Unless the package says it's Debian, 2.0-rc1 is a prerelease like in semver
+            if hint != "debian" and not revision[:1].isdigit():
+                upstream, revision = f"{upstream}~{revision}", ""
+    else:
+        upstream = version
+    return (epoch, _runs(upstream), _runs(revision))
+
+
+def newest(versions: Iterable[str], hint: str | None = None) -> str | None:
+    return max(versions, key=lambda v: sort_key(v, hint), default=None)
+
+
+def newest_first(versions: Iterable[str], hint: str | None = None) -> list[str]:
+    return sorted(versions, key=lambda v: sort_key(v, hint), reverse=True)
+
+
+def is_newer(version: str, than: str, hint: str | None = None) -> bool:
+    return sort_key(version, hint) > sort_key(than, hint)
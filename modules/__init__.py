@@ -1,10 +1,16 @@
 from os.path import dirname, basename, isfile, join
 import glob
+import importlib
+
+from libraries import moduleLib
 
 modules = glob.glob(join(dirname(__file__), "*.py"))
 __all__ = [
     basename(f)[:-3] for f in modules if isfile(f) and not f.endswith("__init__.py")
 ]
-from . import *
 
-# https://stackoverflow.com/a/1057534
+# Modules listed in the manifest are only imported once one of their hooks is used
+manifest_files = moduleLib.load_manifest(join(dirname(__file__), "manifest.json"))
+for module in __all__:
+    if module not in manifest_files:
+        importlib.import_module(f"{__name__}.{module}")
@@ -1,8 +1,9 @@
+from collections.abc import Generator, Iterator
 from pathlib import Path
-import requests
 import re
-import copy
 import os
+import sys
+import time
 from libraries.dataClasses import (
     Candidate,
     Installation,
@@ -11,59 +12,140 @@ from libraries.exceptions import (
     APICallFailed,
     ModuleError,
     AlreadyInstalled,
-    SpecificVersion,
-    NoCandidate,
-    AlreadyNewest,
 )
-from libraries.utilitiesLib import download_file
+from libraries import httpLib
+from libraries import outputLib
+from libraries import storeLib
 from libraries import manageInstalledLib
 from libraries import launcherLib
 from libraries import pathLib
 from libraries import moduleLib
-from libraries import sourcesLib
+from libraries import settingsLib
+from libraries import versionLib
 
 
 def get_page(url: str):
-    response = requests.get(url)
+    response = httpLib.cached_page(url)
     if response.status_code != 200:
         raise APICallFailed(f"Failed to get index page by url: {url}")
     return response.text
 
 
+def get_lines(url: str) -> Iterator[str]:
+    # Streamed, so a pipeline that has found its row can stop before the rest arrives
+    response = httpLib.cached_page(url, stream=True)
+    if response.status_code != 200:
+        raise APICallFailed(f"Failed to get index page by url: {url}")
+    return response.iter_lines()
+
+
 amd_arch = {"x86_64": "amd64"}
 
 
-def run_search(
-    searches: list[dict], data: dict, target: str, version_filter: str = ""
-) -> dict:
-    searches = copy.deepcopy(searches)
-    search = searches.pop(0)
-    if search["kind"] == "per_line":
-        data[target] = []
-        for line in get_page(search["url"]).split("\n"):
-            line = line.strip()
-            match = re.search(search["regex"], line.strip())
-            if match is None:
-                continue
-            groups = match.groups()
-            match_contents = {}
-            for i, k in enumerate(search["regex_groups"]):
-                match_contents[k] = groups[i]
-            data[target].append(match_contents)
-
-    elif search["kind"] == "filter_version":
-        if version_filter == "":
+def _compile(spec: dict) -> re.Pattern:
+    try:
+        return re.compile(spec["regex"])
+    except re.error as e:
+        raise ModuleError(f"Invalid regex in {spec['kind']} step: {e}")
+
+
+def _require(spec: dict, *keys: str) -> None:
+    missing = [k for k in keys if k not in spec]
+    if len(missing) != 0:
+        raise ModuleError(f"{spec['kind']} step is missing {', '.join(missing)}")
+
+
+class _Run:
+    def __init__(self, target: str, version_filter: str, version_scheme: str | None):
+        self.target = target
+        self.version_filter = version_filter
+        self.version_scheme = version_scheme
+        self.finished = False
+        self.timings: list[tuple[str, float]] = []
+
+
+# Each step takes the data so far and returns it, usually the same dict. filter_version
+# is the exception, it narrows the data down to the row of the chosen version. The rows
+# of a per_line step are an iterator over the page as it streams in, until filter_version
+# or the end of the run consumes them
+
+
+def _close(rows) -> None:
+    # Closing the rows closes the page they're read from
+    if isinstance(rows, Generator):
+        rows.close()
+
+
+def _mapped(func, rows: Iterator[dict]) -> Iterator[dict]:
+    try:
+        for row in rows:
+            yield func(row)
+    finally:
+        _close(rows)
+
+
+class _PerLine:
+    kind = "per_line"
+
+    def __init__(self, spec: dict):
+        _require(spec, "url", "regex", "regex_groups")
+        self.url = spec["url"]
+        self.regex = _compile(spec)
+        self.groups = spec["regex_groups"]
+
+    def rows(self) -> Iterator[dict]:
+        search = self.regex.search
+        lines = get_lines(self.url)
+        try:
+            for line in lines:
+                match = search(line.strip())
+                if match is not None:
+                    yield dict(zip(self.groups, match.groups()))
+        finally:
+            _close(lines)
+
+    def run(self, data: dict, run: _Run) -> dict:
+        data[run.target] = self.rows()
+        return data
+
+
+class _FilterVersion:
+    kind = "filter_version"
+
+    def __init__(self, spec: dict):
+        pass
+
+    def run(self, data: dict, run: _Run) -> dict:
+        if run.version_filter == "":
+            run.finished = True
             return data
-        elif version_filter == "install-newest":
-            data = sorted(
-                data[target],
-                key=lambda x: x["version"],
-                reverse=True,
-            )[0]
-        else:
-            data = [x for x in data[target] if x["version"] == version_filter][0]
+        rows = data[run.target]
+        if run.version_filter == "install-newest":
+            newest = max(
+                rows,
+                key=lambda x: versionLib.sort_key(x["version"], run.version_scheme),
+                default=None,
+            )
+            if newest is None:
+                raise ModuleError("No versions found")
+            return newest
+        # Stops reading the page at the first row of the version
+        try:
+            for row in rows:
+                if row["version"] == run.version_filter:
+                    return row
+        finally:
+            _close(rows)
+        raise ModuleError(f"Version {run.version_filter} not found")
+
+
+class _PopulateSystem:
+    kind = "populate_system"
+
+    def __init__(self, spec: dict):
+        pass
 
-    elif search["kind"] == "populate_system":
+    def run(self, data: dict, run: _Run) -> dict:
         import platform
 
         p = platform.freedesktop_os_release()
@@ -77,49 +159,127 @@ def run_search(
         data["System_Arch"] = m.title()
         data["system_arch_amd"] = amd_arch.get(m.lower(), "none").lower()
         data["System_Arch_Amd"] = amd_arch.get(m.lower(), "none").title()
+        return data
+
 
-    elif search["kind"] == "one_shot":
-        page = get_page(search["url"].format(**data))
-        match = re.search(search["regex"], page)
+class _OneShot:
+    kind = "one_shot"
+
+    def __init__(self, spec: dict):
+        _require(spec, "url", "regex", "regex_groups")
+        self.url = spec["url"]
+        self.regex = _compile(spec)
+        self.groups = spec["regex_groups"]
+
+    def run(self, data: dict, run: _Run) -> dict:
+        match = self.regex.search(get_page(self.url.format(**data)))
         if match is None:
             raise ModuleError("Unable to match one-shot regex")
-        groups = match.groups()
-        for i, k in enumerate(search["regex_groups"]):
-            data[k] = groups[i]
-
-    elif search["kind"] == "construct":
-        data[search["name"]] = search["value"].format(**data)
-
-    elif search["kind"] == "target":
-        if search["target"] == "versions":
-            for i in range(len(data[target])):
-                item = data[target][i]
-                if "sv1" in item or "sv2" in item or "sv3" in item:
-                    data[target][i]["semver"] = (
-                        item.get("sv3", "0")
-                        + "."
-                        + item.get("sv2", "0")
-                        + "."
-                        + item.get("sv1", "0")
-                    )
-                if "semver" in item:
-                    data[target][i]["version"] = item["semver"]
-        elif search["target"] == "download_url":
-            url = search["url"].format(**data)
-            data["download_url"] = url
-            # if "filename" not in data:
-            #     data["filename"] = url.rsplit("/", 1)[1]
+        data.update(zip(self.groups, match.groups()))
+        return data
+
+
+class _Construct:
+    kind = "construct"
+
+    def __init__(self, spec: dict):
+        _require(spec, "name", "value")
+        self.name = spec["name"]
+        self.value = spec["value"]
+
+    def run(self, data: dict, run: _Run) -> dict:
+        data[self.name] = self.value.format(**data)
+        return data
+
+
+class _Target:
+    kind = "target"
+
+    def __init__(self, spec: dict):
+        _require(spec, "target")
+        self.target = spec["target"]
+        if self.target == "download_url":
+            _require(spec, "url")
+            self.url = spec["url"]
+        elif self.target != "versions":
+            raise ModuleError(f"Unknown target: {self.target}")
+
+    @staticmethod
+    def version(item: dict) -> dict:
+        if "sv1" in item or "sv2" in item or "sv3" in item:
+            item["semver"] = (
+                item.get("sv3", "0")
+                + "."
+                + item.get("sv2", "0")
+                + "."
+                + item.get("sv1", "0")
+            )
+        if "semver" in item:
+            item["version"] = item["semver"]
+        return item
+
+    def run(self, data: dict, run: _Run) -> dict:
+        if self.target == "versions":
+            data[run.target] = _mapped(self.version, data[run.target])
         else:
-            ModuleError(f"Unknown target: {search['target']}")
-        if target == search["target"]:
-            return data
-
-    else:
-        ModuleError(f"Unknown kind: {search['kind']}")
-
-    if len(searches) != 0:
-        data = run_search(searches, data, target, version_filter=version_filter)
-    return data
+            data["download_url"] = self.url.format(**data)
+        if run.target == self.target:
+            run.finished = True
+        return data
+
+
+_STEPS = {
+    step.kind: step
+    for step in (_PerLine, _FilterVersion, _PopulateSystem, _OneShot, _Construct, _Target)
+}
+
+
+class Pipeline:
+    def __init__(self, searches: list[dict], version_scheme: str | None = None):
+        # Checked once up front, so a broken definition fails before anything is fetched
+        if version_scheme is not None and version_scheme not in versionLib.schemes:
+            raise ModuleError(f"Unknown version scheme: {version_scheme}")
+        self.version_scheme = version_scheme
+        self.steps = []
+        for spec in searches:
+            if spec.get("kind") not in _STEPS:
+                raise ModuleError(f"Unknown kind: {spec.get('kind')}")
+            self.steps.append(_STEPS[spec["kind"]](spec))
+        self.timings: list[tuple[str, float]] = []
+
+    def run(self, target: str, version_filter: str = "") -> dict:
+        run = _Run(target, version_filter, self.version_scheme)
+        data: dict = {}
+        for step in self.steps:
+            start = time.perf_counter()
+            data = step.run(data, run)
+            run.timings.append((step.kind, time.perf_counter() - start))
+            if run.finished:
+                break
+        if isinstance(data.get(run.target), Iterator):
+            data[run.target] = list(data[run.target])
+        self.timings = run.timings
+        if settingsLib.get("dotdeb_timings"):
+            for kind, seconds in run.timings:
+                print(f"dotdeb {kind:16} {seconds * 1000:8.1f} ms", file=sys.stderr)
+        return data
+
+
+# Compiled once per package per process, versions/install/upgrade reuse the same steps
+_pipelines: dict[str, tuple[tuple, Pipeline]] = {}
+
+
+def pipeline(candidate: Candidate) -> Pipeline:
+    definition = (
+        candidate.module_data["info_gathering"],
+        candidate.module_data.get("version_scheme"),
+    )
+    cached = _pipelines.get(candidate.package_name)
+    if cached is not None and cached[0] == definition:
+        return cached[1]
+    compiled = Pipeline(*definition)
+    _pipelines[candidate.package_name] = (definition, compiled)
+    return compiled
 
 
 def setup() -> None:
@@ -157,17 +317,19 @@ def install(
     version_locked = False if version is None else True
     version_filter = "install-newest" if version is None else version
     if data is None:
-        searches = candidate.module_data["info_gathering"]
-        data = run_search(searches, {}, "download_url", version_filter=version_filter)
+        data = pipeline(candidate).run("download_url", version_filter=version_filter)
     download_url = data["download_url"]
     filename = (
         data["filename"] if "filename" in data else download_url.rsplit("/", 1)[1]
     )
     executable_path = Path("~/.fluffpkg/data/dotdeb/files/").expanduser() / filename
+    expected = {a: data[a] for a in ("sha256", "sha512") if a in data}
+    expected.update(candidate.module_data.get("checksums", {}).get(filename, {}))
     try:
-        download_file(download_url, output=executable_path, prettyname=filename)
-    except requests.exceptions.HTTPError:
-        print()
+        digest = storeLib.fetch(
+            download_url, executable_path, prettyname=filename, expected=expected
+        )
+    except httpLib.HTTPError:
         raise ModuleError(
             "Failed to download. This could be an error in the package definitions, or this package may not be available for your system."
         )
@@ -186,6 +348,7 @@ def install(
         data["version"],
         str(executable_path.resolve()),
         version_locked=version_locked,
+        sha256=digest,
     )
     print(f"{candidate.name} successfully installed!")
 
@@ -245,39 +408,36 @@ def remove(installation: Installation, upgrade: bool = False) -> None:
     print(f"{package} successfully removed")
 
 
-def upgrade_cmd(installation: Installation, cmd_args: dict) -> None:
-    upgrade(installation, cmd_args["--force"])
-
-
-def upgrade(installation: Installation, force: bool = False) -> None:
-    # print(installation.package_name)
-    # print(installation.version)
-
-    if installation.version_locked and not force:
-        raise SpecificVersion()
-
-    candidate = sourcesLib.get_source(installation.package_name)
-
-    if candidate is None:
-        raise NoCandidate()
+def check_latest(
+    installation: Installation, candidate: Candidate, cmd_args: dict
+) -> dict:
+    return pipeline(candidate).run("download_url", version_filter="install-newest")
 
-    searches = candidate.module_data["info_gathering"]
-    data = run_search(searches, {}, "download_url", version_filter="install-newest")
 
-    new_version = data["version"]
-    if new_version == installation.version:
-        raise AlreadyNewest(installation.package_name)
+def apply_upgrade(
+    installation: Installation, candidate: Candidate, latest: dict, cmd_args: dict
+) -> None:
     remove(installation, upgrade=True)
     install(
-        candidate, not installation.launcher, installation.path, upgrade=True, data=data
+        candidate,
+        not installation.launcher,
+        installation.path,
+        upgrade=True,
+        data=latest,
     )
 
 
 def versions_cmd(candidate: Candidate, cmd_args: dict) -> None:
-    searches = candidate.module_data["info_gathering"]
-    data = {}
-    data = run_search(searches, data, target="versions")
-    versions = [v["version"] for v in data["versions"][::-1]]
+    compiled = pipeline(candidate)
+    data = compiled.run("versions")
+    versions = versionLib.newest_first(
+        (v["version"] for v in data["versions"]), compiled.version_scheme
+    )
+    if cmd_args.get("--format") is not None:
+        outputLib.print_records(
+            cmd_args["--format"], ["version"], ([v] for v in versions)
+        )
+        return
     if len(versions) > 15:
         versions = versions[:15] + ["..."]
     print("\n".join(versions))
@@ -288,7 +448,8 @@ moduleLib.register(
     {
         "install": install_cmd,
         "remove": remove_cmd,
-        "upgrade": upgrade_cmd,
+        "check_latest": check_latest,
+        "apply_upgrade": apply_upgrade,
         "versions": versions_cmd,
         # "execpath": execpath_cmd,
         # "commands": [],
@@ -1,5 +1,4 @@
 from pathlib import Path
-import requests
 import os
 import stat
 import platform
@@ -13,26 +12,36 @@ from libraries.dataClasses import (
     ValueArg,
 )
 from libraries.exceptions import (
-    AlreadyNewest,
+    ModuleError,
     NoCandidate,
-    SpecificVersion,
     AlreadyInstalled,
     APICallFailed,
 )
-from libraries.utilitiesLib import user_pick, download_file
+from libraries.utilitiesLib import user_pick, parse_checksums
+from libraries import httpLib
+from libraries import outputLib
 from libraries import manageInstalledLib
+from libraries import storeLib
 from libraries import sourcesLib
 from libraries import launcherLib
 from libraries import pathLib
 from libraries import moduleLib
+from libraries import versionLib
 
 
-def get_github_release(api_url: str, appimage_filter: str) -> dict:
-    response = requests.get(api_url)
+def get_github_release(
+    api_url: str, appimage_filter: str, interactive: bool = True
+) -> dict:
+    response = httpLib.cached_get(api_url)
     if response.status_code != 200:
         raise APICallFailed(f"Failed to get repository by url: {api_url}")
 
-    release = response.json()
+    return select_appimage(response.json(), appimage_filter, interactive=interactive)
+
+
+def select_appimage(
+    release: dict, appimage_filter: str, interactive: bool = True
+) -> dict:
     # print(release["assets"])
     appimages = []
     for a in release["assets"]:
@@ -44,18 +53,25 @@ def get_github_release(api_url: str, appimage_filter: str) -> dict:
         # else:
         #     print(a["content_type"], a["name"])
 
+    checksum_assets = [
+        (a["name"], a["browser_download_url"])
+        for a in release["assets"]
+        if re.search(r"sha256|sha512|checksum", a["name"], re.IGNORECASE) is not None
+        and not a["name"].lower().endswith((".sig", ".asc", ".pem", ".appimage"))
+    ]
+
     if len(appimages) == 0:
         # import json
         # print(json.dumps(release["assets"]))
-        print("No release assets of content type 'appimage'")
-        exit()
+        raise ModuleError("No release assets of content type 'appimage'")
 
     original_appimages = appimages
 
     new_appimage_filter = None
 
     if len(appimages) != 1 and appimage_filter != "":
-        print("Searching by filter:", appimage_filter)
+        if interactive:
+            print("Searching by filter:", appimage_filter)
         appimages = [
             a
             for a in appimages
@@ -63,7 +79,8 @@ def get_github_release(api_url: str, appimage_filter: str) -> dict:
         ]
 
     if len(appimages) == 0:
-        print("Warning: user filter left no options. Ignoring...")
+        if interactive:
+            print("Warning: user filter left no options. Ignoring...")
         appimages = original_appimages
 
     if len(appimages) != 1:
@@ -71,6 +88,16 @@ def get_github_release(api_url: str, appimage_filter: str) -> dict:
         # print(f"Warning: multiple appimages found. Filtering by architecture: {arch}")
         appimages = [a for a in appimages if arch in a["name"]]
 
+    if len(appimages) != 1 and not interactive:
+        # Picking needs the user, so it is left for when the release is installed
+        return {
+            "Tag": release["tag_name"],
+            "Name": release["name"],
+            "Appimage": None,
+            "filter": None,
+            "Release": release,
+        }
+
     if len(appimages) != 1:
         appimage = appimages[
             user_pick(
@@ -96,10 +123,27 @@ def get_github_release(api_url: str, appimage_filter: str) -> dict:
             "Name": appimage["name"],
             "DownloadUrl": appimage["browser_download_url"],
         },
+        "ChecksumAssets": checksum_assets,
         "filter": new_appimage_filter,
     }
 
 
+def get_release_checksums(release: dict) -> dict[str, str]:
+    # Only <appimage>.sha256/.sha512 may hold a bare hash, anything else has to name the
+    # appimage. The first file to give a hash for it keeps it
+    appimage = release["Appimage"]["Name"]
+    own = (f"{appimage}.sha256".lower(), f"{appimage}.sha512".lower())
+    checksums = {}
+    for name, url in release.get("ChecksumAssets", []):
+        lone = name.lower() in own
+        response = httpLib.get(url)
+        if response.status_code != 200:
+            continue
+        for algorithm, digest in parse_checksums(response.text, appimage, lone).items():
+            checksums.setdefault(algorithm, digest)
+    return checksums
+
+
 def try_get_by_tag(api_url: str, appimage_filter: str) -> dict | None:
     try:
         return get_github_release(api_url, appimage_filter=appimage_filter)
@@ -130,10 +174,20 @@ def get_github_by_tag(url: str, tag: str, appimage_filter: str) -> dict:
     raise APICallFailed(f"Failed to get version {tag}")
 
 
-def get_github_latest_release(url: str, appimage_filter: str) -> dict:
+def get_github_latest_release(
+    url: str, appimage_filter: str, interactive: bool = True
+) -> dict:
     owner, repo = url.split("/")
     api_url = f"https://api.github.com/repos/{owner}/{repo}/releases/latest"
-    return get_github_release(api_url, appimage_filter=appimage_filter)
+    return get_github_release(
+        api_url, appimage_filter=appimage_filter, interactive=interactive
+    )
+
+
+def resolve_release(release: dict, appimage_filter: str) -> dict:
+    if release["Appimage"] is not None:
+        return release
+    return select_appimage(release["Release"], appimage_filter)
 
 
 def setup() -> None:
@@ -160,13 +214,19 @@ def install(
     path: bool = False,
     version: str | None = None,
     upgrade=False,
+    release=None,
 ) -> None:
     if manageInstalledLib.check_installed(candidate) and not upgrade:
         raise AlreadyInstalled(candidate.package_name)
     setup()
     assert candidate.module == "github-appimage"
     # print(candidate)
-    if version is None or isinstance(version, bool):
+    if release is not None:
+        release = resolve_release(
+            release, candidate.module_data.get("user_select_filter", "")
+        )
+        version_locked = False
+    elif version is None or isinstance(version, bool):
         release = get_github_latest_release(
             candidate.download_url,
             appimage_filter=candidate.module_data.get("user_select_filter", ""),
@@ -188,7 +248,9 @@ def install(
     url = release["Appimage"]["DownloadUrl"]
     name = release["Appimage"]["Name"]
     executable_path = Path("~/.fluffpkg/data/appimage/files/").expanduser() / name
-    download_file(url, output=executable_path, prettyname=name)
+    expected = get_release_checksums(release)
+    expected.update(candidate.module_data.get("checksums", {}).get(name, {}))
+    digest = storeLib.fetch(url, executable_path, prettyname=name, expected=expected)
     os.chmod(
         executable_path, os.stat(executable_path).st_mode | stat.S_IXUSR | stat.S_IXGRP
     )
@@ -197,6 +259,7 @@ def install(
         release["Tag"],
         str(executable_path.resolve()),
         version_locked=version_locked,
+        sha256=digest,
     )
     print(f"{candidate.name} successfully installed!")
 
@@ -223,7 +286,7 @@ def add_cmd(cmd_args: dict) -> None:
 def add(owner: str, repo: str, failExists=False) -> Candidate:
     api_url = f"https://api.github.com/repos/{owner}/{repo}"
 
-    response = requests.get(api_url)
+    response = httpLib.cached_get(api_url)
     if response.status_code != 200:
         # print(
         #     f"Error: Failed to get GitHub repository: {response.status_code} - {response.text}"
@@ -299,41 +362,48 @@ def remove(installation: Installation, upgrade: bool = False) -> None:
     print(f"{package} successfully removed")
 
 
-def upgrade_cmd(installation: Installation, cmd_args: dict) -> None:
-    upgrade(installation, cmd_args["--force"])
-
-
-def upgrade(installation: Installation, force: bool = False) -> None:
-    # print(installation.package_name)
-    # print(installation.version)
-
-    if installation.version_locked and not force:
-        raise SpecificVersion()
-
-    candidate = sourcesLib.get_source(installation.package_name)
-
-    if candidate is None:
-        raise NoCandidate()
-
-    new_version = get_github_latest_release(
+def check_latest(
+    installation: Installation, candidate: Candidate, cmd_args: dict
+) -> dict:
+    release = get_github_latest_release(
         candidate.download_url,
         appimage_filter=candidate.module_data.get("user_select_filter", ""),
-    )["Tag"]
-    if new_version == installation.version:
-        raise AlreadyNewest(installation.package_name)
+        interactive=False,
+    )
+    return {"version": release["Tag"], "release": release}
+
+
+def apply_upgrade(
+    installation: Installation, candidate: Candidate, latest: dict, cmd_args: dict
+) -> None:
+    release = resolve_release(
+        latest["release"], candidate.module_data.get("user_select_filter", "")
+    )
     remove(installation, upgrade=True)
-    install(candidate, not installation.launcher, installation.path, upgrade=True)
+    install(
+        candidate,
+        not installation.launcher,
+        installation.path,
+        upgrade=True,
+        release=release,
+    )
 
 
 def versions_cmd(candidate: Candidate, cmd_args: dict) -> None:
-    versions(candidate)
+    tag_names = versions(candidate)
+    if cmd_args.get("--format") is not None:
+        outputLib.print_records(
+            cmd_args["--format"], ["version"], ([t] for t in tag_names)
+        )
+    else:
+        print("\n".join(tag_names))
 
 
-def versions(candidate: Candidate) -> None:
+def versions(candidate: Candidate) -> list[str]:
     owner, repo = candidate.download_url.split("/", 1)
     api_url = f"https://api.github.com/repos/{owner}/{repo}/tags"
 
-    response = requests.get(api_url)
+    response = httpLib.cached_get(api_url)
     if response.status_code != 200:
         print(
             f"Error: Failed to get GitHub tags: {response.status_code} - {response.text}"
@@ -348,11 +418,21 @@ def versions(candidate: Candidate) -> None:
             tag_names.append(tag.replace("V", "", 1))
         else:
             tag_names.append(tag)
-    print("\n".join(tag_names))
+    return versionLib.newest_first(
+        tag_names, candidate.module_data.get("version_scheme")
+    )
 
 
 def execpath_cmd(installation: Installation, cmd_args: dict) -> None:
-    print(execpath(installation, cmd_args["--noversion"]))
+    path = execpath(installation, cmd_args["--noversion"])
+    if cmd_args.get("--format") is not None:
+        outputLib.print_records(
+            cmd_args["--format"],
+            ["package_name", "executable_path"],
+            [[installation.package_name, path]],
+        )
+    else:
+        print(path)
 
 
 def execpath(installation: Installation, noVersion: bool = False) -> str:
@@ -383,7 +463,8 @@ moduleLib.register(
     {
         "install": install_cmd,
         "remove": remove,
-        "upgrade": upgrade_cmd,
+        "check_latest": check_latest,
+        "apply_upgrade": apply_upgrade,
         "versions": versions_cmd,
         "execpath": execpath_cmd,
         "commands": [